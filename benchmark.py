@@ -0,0 +1,268 @@
+import copy, json, multiprocessing, platform, random, resource, sys, time, tracemalloc
+import numpy as np
+import torch
+from collections import namedtuple
+
+from neat_dynamics.config import make_parser, parse_config
+from neat_dynamics.dynamics.ensemble_model import make_ensemble_model
+from neat_dynamics.dynamics.experience import Experience
+from neat_dynamics.dynamics.replay_memory import ReplayMemory
+from neat_dynamics.metrics.generation_metrics import current_rss
+from neat_dynamics.neat.array_genome import ArrayGenome
+from neat_dynamics.neat.compact_population import CompactPopulation
+from neat_dynamics.novelty.dynamic_qd import ArchivedOrganism, DynamicArchive, RepoOrgansim
+
+# Sizes of the synthetic observations, actions and skill descriptors, LunarLander's
+OB_DIM = 8
+AC_DIM = 4
+DESCRIPTOR_DIM = 2
+# Structural mutation rounds applied to every synthetic genome
+MUTATION_ROUNDS = 10
+# Species the synthetic populations are split into before respeciation
+NUM_SPECIES = 10
+# Generations evolved before the timed one, so the archive is past min_archive_size
+WARMUP_GENERATIONS = 5
+
+def random_transitions(rng, num_exps):
+    """Get num_exps random transitions as the arrays add_transitions takes."""
+    return (
+        rng.standard_normal((num_exps, OB_DIM)).astype(np.float32),
+        rng.integers(AC_DIM, size=num_exps),
+        rng.standard_normal(num_exps).astype(np.float32),
+        rng.standard_normal((num_exps, OB_DIM)).astype(np.float32),
+        rng.random(num_exps) < 0.01)
+
+def full_memory(config, rng):
+    """Get a ReplayMemory filled to capacity with random transitions."""
+    memory = ReplayMemory(config, OB_DIM)
+    memory.add_transitions(*random_transitions(rng, config.memory_capacity))
+    return memory
+
+def synthetic_population(args, config, pop_size):
+    """Get a CompactPopulation of pop_size organisms in NUM_SPECIES species, with mutated genomes and random fitness."""
+    pop_args = copy.copy(args)
+    pop_args.init_pop_size = pop_size
+    pop_args.max_species = NUM_SPECIES
+    population = CompactPopulation(pop_args, config, OB_DIM, AC_DIM)
+    population.setup_genome(ArrayGenome.initial(OB_DIM, AC_DIM))
+    for _ in range(MUTATION_ROUNDS):
+        for org in population.orgs:
+            population.mutate_child(org.genome)
+    for org in population.orgs:
+        org.avg_fitness = np.random.random()
+    return population
+
+def bench_archive_add(args, config, size):
+    """Offer num_queries organisms one at a time to an archive of size members."""
+    rng = np.random.default_rng(size)
+    # Spread the descriptors so the archive is equally dense at every size
+    scale = config.novel_threshold * np.sqrt(size)
+    archive = DynamicArchive(config)
+    archive.restore(
+        [RepoOrgansim(ArchivedOrganism(i, rng.random(), 0), config.novel_threshold, descriptor)
+            for i, descriptor in enumerate(rng.uniform(0, scale, (size, DESCRIPTOR_DIM)))],
+        [])
+    orgs = [ArchivedOrganism(size + i, rng.random(), 1) for i in range(args.num_queries)]
+    descriptors = rng.uniform(0, scale, (args.num_queries, DESCRIPTOR_DIM))
+
+    def run():
+        for org, descriptor in zip(orgs, descriptors):
+            archive.attempt_add_archive(org, descriptor)
+    return len(orgs), run
+
+def bench_speciate_fn(args, config, size):
+    """Compare num_queries random pairs of genomes from a population of size organisms."""
+    population = synthetic_population(args, config, size)
+    pairs = np.random.randint(size, size=(args.num_queries, 2))
+    genomes = [population.genome(org) for org in population.orgs]
+
+    def run():
+        for i, j in pairs:
+            population.speciate_fn(genomes[i], genomes[j])
+    return len(pairs), run
+
+def bench_respeciate(args, config, size):
+    """Respeciate a population of size organisms."""
+    population = synthetic_population(args, config, size)
+    return size, population.respeciate
+
+def bench_replay_append(args, config, size):
+    """Append num_queries transitions one at a time to a full ReplayMemory."""
+    rng = np.random.default_rng(0)
+    memory = full_memory(config, rng)
+    states, actions, rewards, next_states, dones = random_transitions(rng, args.num_queries)
+    exps = [
+        Experience(torch.from_numpy(states[i]), int(actions[i]), float(rewards[i]), torch.from_numpy(next_states[i]), bool(dones[i]))
+        for i in range(args.num_queries)]
+
+    def run():
+        for e_t in exps:
+            memory.append(e_t)
+    return len(exps), run
+
+def bench_replay_sample(args, config, size):
+    """Sample num_queries training batches for the whole ensemble from a full ReplayMemory."""
+    memory = full_memory(config, np.random.default_rng(0))
+    batch_size = config.batch_size * config.ensemble_size
+
+    def run():
+        for _ in range(args.num_queries):
+            memory.sample(batch_size)
+    return args.num_queries, run
+
+def bench_ensemble_train(args, config, size):
+    """Take num_train_steps training steps of the dynamics ensemble on a full replay memory."""
+    ensemble = make_ensemble_model(config, AC_DIM, OB_DIM, full_memory(config, np.random.default_rng(0)))
+
+    def run():
+        for _ in range(args.num_train_steps):
+            ensemble.train()
+    return args.num_train_steps, run
+
+def random_evaluation(population, config):
+    """Give every organism a random fitness and get random skill descriptors for them."""
+    for org in population.orgs:
+        org.avg_fitness = np.random.random()
+    return list(np.random.uniform(0, config.novel_threshold * 10, (len(population.orgs), DESCRIPTOR_DIM)))
+
+def bench_evolve(args, config, size):
+    """Evolve one generation of a population of init_pop_size organisms."""
+    population = synthetic_population(args, config, args.init_pop_size)
+    for _ in range(WARMUP_GENERATIONS):
+        population.evolve(random_evaluation(population, config))
+    skill_descriptors = random_evaluation(population, config)
+
+    def run():
+        population.evolve(skill_descriptors)
+    return 1, run
+
+def benchmark_cases(args):
+    """Get the name, factory and size of every benchmark, the sized ones once per size."""
+    cases = []
+    for size in args.archive_sizes:
+        cases.append(("archive_add/%d" % size, bench_archive_add, size))
+    for size in args.population_sizes:
+        cases.append(("speciate_fn/%d" % size, bench_speciate_fn, size))
+        cases.append(("respeciate/%d" % size, bench_respeciate, size))
+    cases.append(("replay_append", bench_replay_append, None))
+    cases.append(("replay_sample", bench_replay_sample, None))
+    cases.append(("ensemble_train", bench_ensemble_train, None))
+    cases.append(("evolve", bench_evolve, None))
+    if args.benchmarks:
+        cases = [case for case in cases if any(case[0].startswith(name) for name in args.benchmarks)]
+    return cases
+
+def seed_all(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def rss_growth(args, config_dict, bench, size, seed):
+    """Get how far the peak resident size of a fresh process grows past its resident size while it runs a benchmark."""
+    # The config travels as a dict, its namedtuple class only exists in the parent process
+    config = namedtuple("GenericDict", config_dict.keys())(**config_dict)
+    seed_all(seed)
+    _, run = bench(args, config, size)
+    before = current_rss()
+    run()
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - before, 0)
+
+def measure(args, config, bench, size):
+    """Get the best time over repeats runs of a benchmark, each on fresh data, and the peak memory of two more.
+
+    tracemalloc sees Python and NumPy allocations but not torch's, so one run
+    also goes to a fresh process whose peak resident growth over the run is
+    recorded, unaffected by the benchmarks before it.
+    """
+    times = []
+    for repeat in range(args.repeats + 1):
+        seed_all(repeat)
+        num_ops, run = bench(args, config, size)
+        if repeat == args.repeats:
+            # Tracing slows allocation down, so the traced run is not timed
+            tracemalloc.start()
+            run()
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        peak_rss_growth = pool.apply(rss_growth, (args, config._asdict(), bench, size, args.repeats))
+
+    best = min(times)
+    return {
+        "ops": num_ops,
+        "seconds": best,
+        "median_seconds": float(np.median(times)),
+        "ops_per_sec": num_ops / best,
+        "peak_traced_bytes": peak_traced,
+        "peak_rss_growth_bytes": peak_rss_growth}
+
+def compare(results, baseline, tolerance):
+    """Get the benchmarks whose throughput fell more than tolerance below the baseline's, with the ratio."""
+    slowdowns = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+
+        ratio = result["ops_per_sec"] / baseline["benchmarks"][name]["ops_per_sec"]
+        if ratio < 1.0 - tolerance:
+            slowdowns.append((name, ratio))
+    return slowdowns
+
+def main(args):
+    config = parse_config("config.ini")
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "torch_threads": torch.get_num_threads(),
+        "benchmarks": {}}
+
+    for name, bench, size in benchmark_cases(args):
+        results["benchmarks"][name] = measure(args, config, bench, size)
+        result = results["benchmarks"][name]
+        print("%-20s %12.1f ops/s %10.2f MiB traced %10.2f MiB resident" % (
+            name, result["ops_per_sec"], result["peak_traced_bytes"] / 2**20, result["peak_rss_growth_bytes"] / 2**20))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        slowdowns = compare(results, baseline, args.tolerance)
+        for name, ratio in slowdowns:
+            print("SLOWDOWN %s runs at %.2fx the baseline throughput" % (name, ratio))
+        if len(slowdowns) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    # The NEAT hyperparameters are main.py's so the benchmarks reproduce its populations
+    parser = make_parser()
+    parser.add_argument("--output", default="benchmark_results.json",
+        help="File the benchmark results are written to as JSON.")
+    parser.add_argument("--baseline", default=None,
+        help="Results file to compare against, exits with status 1 on any slowdown.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+        help="Fraction of the baseline throughput a benchmark may lose before it is flagged.")
+    parser.add_argument("--repeats", type=int, default=3,
+        help="Number of timed runs of each benchmark, the fastest is kept.")
+    parser.add_argument("--benchmarks", nargs="*", default=[],
+        help="Names, or name prefixes, of the benchmarks to run, all of them by default.")
+    parser.add_argument("--archive_sizes", type=int, nargs="+", default=[1000, 4000, 16000],
+        help="Archive sizes attempt_add_archive is timed at.")
+    parser.add_argument("--population_sizes", type=int, nargs="+", default=[150, 600, 2400],
+        help="Population sizes speciation is timed at.")
+    parser.add_argument("--num_queries", type=int, default=1000,
+        help="Number of archive offers, genome comparisons, appends or batch samples per run.")
+    parser.add_argument("--num_train_steps", type=int, default=20,
+        help="Number of ensemble training steps per run.")
+
+    args = parser.parse_args()
+    main(args)
@@ -1,121 +1,151 @@
-import argparse
-from collections import namedtuple
-import configparser
+import copy
 
+from neat_dynamics.config import make_parser, parse_config
 from neat_dynamics.env.lundar_lander import LundarLanderNovelty
 from neat_dynamics.env.cartpole import CartPole
-
-def parse_config(config_file):
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    config_dict = {}
-    
-    config_dict["lr"] = float(config["DEFAULT"]["lr"])
-    config_dict["ensemble_size"] = int(config["DEFAULT"]["ensemble_size"])
-    config_dict["memory_capacity"] = int(config["DEFAULT"]["memory_capacity"])
-    config_dict["hidden_size"] = int(config["DEFAULT"]["hidden_size"])
-    config_dict["num_hidden"] = int(config["DEFAULT"]["num_hidden"])
-    config_dict["novel_threshold"] = float(config["DEFAULT"]["novel_threshold"])
-    config_dict["novelty_neighbors"] = int(config["DEFAULT"]["novelty_neighbors"])
-    config_dict["min_archive_size"] = int(config["DEFAULT"]["min_archive_size"])
-    config_dict["min_reproduce"] = int(config["DEFAULT"]["min_reproduce"])
-
-
-
-    config = namedtuple("GenericDict", config_dict.keys())(**dict(config_dict.items()))
-
-    return config
-
+from neat_dynamics.dynamics.background_trainer import BackgroundTrainer
+from neat_dynamics.dynamics.ensemble_model import make_ensemble_model
+from neat_dynamics.dynamics.inference_engine import InferenceEngine
+from neat_dynamics.evaluation.early_stop import RolloutController
+from neat_dynamics.evaluation.imagination import ImaginationEvaluator
+from neat_dynamics.evaluation.parallel import ParallelEvaluator
+from neat_dynamics.evaluation.racing import RacingEvaluator
+from neat_dynamics.evaluation.rollout import ENV_SPECS, SerialEvaluator, env_dims, make_env
+from neat_dynamics.evaluation.vectorized import VectorizedEvaluator
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+from neat_dynamics.neat.array_genome import ArrayGenome
+from neat_dynamics.neat.checkpoint import Checkpointer
+from neat_dynamics.neat.compact_population import CompactPopulation
+from neat_dynamics.neat.islands import IslandModel
+from neat_dynamics.neat.steady_state import SteadyStateEvolution
 
 def main(args):
     config = parse_config("config.ini")
+    if args.islands > 1:
+        # Each island evolves and evaluates its own population in its own process
+        islands = IslandModel(args, config, ENV_SPECS["cartpole" if args.env == "cartpole" else "lunar_lander"])
+        islands.metrics = GenerationMetrics(args.metrics_file)
+        try:
+            for record in islands.run(100000):
+                print("ISLAND", record["island"], "GENERATION", record["generation"], "SECONDS", round(record["seconds"], 3),
+                    "BEST", record["best_fitness"], "ARCHIVE", record.get("archive_members"), "MIGRANTS IN", record["migrants_received"])
+        finally:
+            islands.metrics.close()
+        return
+
+    if args.steady_state:
+        # Breed a replacement as soon as any evaluation returns instead of waiting for the generation
+        steady_state = SteadyStateEvolution(args, config, ENV_SPECS["cartpole" if args.env == "cartpole" else "lunar_lander"])
+        steady_state.metrics = steady_state.population.metrics = GenerationMetrics(
+            args.metrics_file, args.profile_generations, args.profile_dir)
+        try:
+            for record in steady_state.run(100000 * args.init_pop_size):
+                print("GENERATION", record["generation"], "SECONDS", round(record["seconds"], 3),
+                    "EVALUATIONS", record["evaluations"], "BEST", record["best_fitness"], "ARCHIVE", record["archive_members"])
+        finally:
+            steady_state.metrics.close()
+        return
+
     if args.env == "cartpole":
         env = CartPole(args, config)
     else: 
         env = LundarLanderNovelty(args, config)
 
-    for i in range(100000):
-        print("\nGENERATION", i)
-        env.eval_population()
+    spec = ENV_SPECS["cartpole" if args.env == "cartpole" else "lunar_lander"]
+    if args.population == "compact":
+        # Evolve packed genomes in place of the env's population of network object graphs
+        dims_env = make_env(spec)
+        num_inputs, num_outputs = env_dims(dims_env)
+        dims_env.close()
+        env.population = CompactPopulation(args, config, num_inputs, num_outputs)
+        env.population.setup_genome(ArrayGenome.initial(num_inputs, num_outputs))
+
+    # Racing rolls out single episodes and decides itself how many each organism gets
+    eval_args = copy.copy(args)
+    if config.racing:
+        eval_args.eval_episodes = 1
+
+    # Cut episodes short once they are stuck or can no longer enter the archive
+    controller = None
+    if config.early_stop_stuck_steps > 0 or config.early_stop_archive_interval > 0:
+        # Pool workers cannot see the archive
+        pooled = args.workers > 1 and not args.vectorized
+        controller = RolloutController(config, spec, None if pooled else env.population.dynamic_archive)
+
+    evaluator = None
+    if args.vectorized:
+        # Roll out organisms in lockstep with batched network inference
+        evaluator = VectorizedEvaluator(eval_args, spec, controller)
+    elif args.workers > 1:
+        # Roll out organisms on a process pool instead of one by one
+        evaluator = ParallelEvaluator(eval_args, spec, controller)
+    elif controller is not None or args.population == "compact":
+        # The env only rolls out organisms that carry a network object graph
+        evaluator = SerialEvaluator(eval_args, spec, controller)
+
+    racing = None
+    if config.racing:
+        # Give more episodes only to organisms that could still enter the archive
+        racing = RacingEvaluator(
+            args, config, evaluator if evaluator is not None else SerialEvaluator(eval_args, spec), env.population.dynamic_archive)
+        evaluator = racing
+
+    if config.imagination:
+        # Score most organisms inside the dynamics ensemble, real rollouts only where it is unsure
+        real_evaluator = evaluator if evaluator is not None else SerialEvaluator(args, spec)
+        if config.background_training:
+            ensemble = BackgroundTrainer(config, real_evaluator.num_outputs, real_evaluator.num_inputs)
+        else:
+            ensemble = make_ensemble_model(config, real_evaluator.num_outputs, real_evaluator.num_inputs)
+        if config.inference_engine:
+            ensemble = InferenceEngine(config, ensemble)
+        evaluator = ImaginationEvaluator(args, config, spec, ensemble, real_evaluator)
+
+    # Binary checkpoints store packed genomes, so they only cover a CompactPopulation
+    compact = isinstance(env.population, CompactPopulation)
+    if args.checkpoint_interval > 0 and not compact:
+        raise ValueError("--checkpoint_interval needs --population compact")
+    # They cover the replay memory as well when the dynamics ensemble is in use
+    checkpointer = Checkpointer(args.checkpoint_dir)
+    imagination = evaluator if config.imagination else None
+    if args.load and compact and checkpointer.exists():
+        checkpointer.load(env.population, imagination)
+
+    # Phase timings and sizes of every generation, evaluation keeps whatever evolve and training do not time
+    metrics = GenerationMetrics(args.metrics_file, args.profile_generations, args.profile_dir)
+    env.population.metrics = metrics
+    if imagination is not None:
+        imagination.metrics = metrics
+    if racing is not None:
+        racing.metrics = metrics
+    if imagination is not None and isinstance(imagination.ensemble, InferenceEngine):
+        imagination.ensemble.metrics = metrics
+
+    try:
+        for i in range(100000):
+            metrics.start_generation(i)
+            with metrics.phase("evaluation"):
+                if evaluator is not None:
+                    # The evaluator rolls out the population itself, the env only holds it
+                    results = evaluator.evaluate(env.population.orgs)
+                    env.population.evolve([result.skill_descriptor for result in results])
+                else:
+                    env.eval_population()
+            if args.checkpoint_interval > 0 and (i + 1) % args.checkpoint_interval == 0:
+                with metrics.phase("checkpoint"):
+                    checkpointer.save(env.population, imagination)
+            if imagination is not None:
+                metrics.set(replay_fill=imagination.ensemble.replay_memory.current_capacity())
+            if controller is not None:
+                metrics.set(total_steps_saved=controller.steps_saved, total_episodes_stopped=controller.episodes_stopped)
+
+            record = metrics.end_generation()
+            print("GENERATION", i, "SECONDS", round(record["seconds"], 3), "ORGS", record.get("orgs"), "ARCHIVE", record.get("archive_members"))
+    finally:
+        metrics.close()
+        if evaluator is not None:
+            evaluator.close()
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument("--init_weight_mean", type=float, default=0.0, 
-        help="Mean of initial weight")
-    parser.add_argument("--init_weight_std", type=float, default=0.4, 
-        help="Std of initial weight")
-    parser.add_argument("--weight_max", type=float, default=100.0, 
-        help="Maximum value of weight.")
-    parser.add_argument("--weight_min", type=float, default=-100.0, 
-        help="Minimum value of weight.")
-    
-    parser.add_argument("--init_bias_mean", type=float, default=0.0, 
-        help="Mean of initial bias")
-    parser.add_argument("--init_bias_std", type=float, default=0.4, 
-        help="Std of initial bias")
-    parser.add_argument("--bias_max", type=float, default=100.0, 
-        help="Maximum value of bias.")
-    parser.add_argument("--bias_min", type=float, default=-100.0, 
-        help="Minimum value of bias.")
-
-    parser.add_argument("--mutate_link_weight_rate", type=float, default=0.8, 
-        help="Probability of mutating all link weights.")
-    parser.add_argument("--mutate_link_weight_rand_rate", type=float, default=0.05, 
-        help="Likelihood of randomly initializing new link weight.")
-    parser.add_argument("--mutate_weight_power", type=float, default=0.4, 
-        help="Power of mutating a weight.")
-    parser.add_argument("--mutate_add_node_rate", type=float, default=0.15, 
-        help="Likelihood of randomly adding a new node.")
-    parser.add_argument("--mutate_add_link_rate", type=float, default=0.30, 
-        help="Likelihood of randomly adding a new link.")
-    parser.add_argument("--mutate_enable_gene", type=float, default=0.25, 
-        help="Likelihood of randomly enabling a gene.")
-    parser.add_argument("--mutate_no_crossover", type=float, default=0.1, 
-        help="Likelihood of copying a parent without crossover.")
-    parser.add_argument("--mutate_add_recur_rate", type=float, default=0.05, 
-        help="Likelihood of adding a recurrent link.")
-    parser.add_argument("--reproduce_avg_trait_rate", type=float, default=0.5, 
-        help="Likelihood of averaging the parents traits.")
-    parser.add_argument("--reproduce_interspecies_rate", type=float, default=0.001, 
-        help="Likelihood of reproducing across species.")
-
-
-    parser.add_argument("--speciate_disjoint_factor", type=float, default=1.0, 
-        help="Gene disjoint factor used for comparing two genotypes.")
-    parser.add_argument("--speciate_weight_factor", type=float, default=3.0, 
-        help="Gene trait weight factor used for comparing two genotypes.")
-    parser.add_argument("--speciate_compat_threshold", type=float, default=3.0, 
-        help="Gene trait weight factor used for comparing two genotypes.")
-    parser.add_argument("--respeciate_size", type=int, default=2, 
-        help="Size for respeciation.")
-    parser.add_argument("--max_species", type=int, default=1, 
-        help="Size for respeciation.")
-    
-
-    parser.add_argument("--init_pop_size", type=int, default=150, 
-        help="Initial population size.")
-    parser.add_argument("--survival_rate", type=float, default=0.2, 
-        help="Percentage of organisms that will survive.")
-    parser.add_argument("--env", default="cartpole", 
-        help="Environment to run..")
-    parser.add_argument("--max_stagnation", type=int, default=20,
-        help="Maximum number of stagnation generations before the species is terminated.")
-    parser.add_argument("--elites", type=int, default=2,
-        help="Number of elites to preserve if a species is terminated.")
-
-    parser.add_argument("--novelty_threshold", type=float, default=3.0,
-        help="Threshold for avg distance in novelty to be added to novelty queue.")
-    parser.add_argument("--novelty_queue_size", type=int, default=1000,
-        help="Number of novelty final states in the queue.")
-    parser.add_argument("--novelty_neighbors", type=int, default=15,
-        help="Number of novelty neighbors used to compute novelty.")
-
-
-    parser.add_argument("--save_file", default="models/population.json",
-        help="Directory to save NEAT models.")
-    parser.add_argument("--load", action="store_true",
-        help="Load existing population from save_file.")
-
-    args = parser.parse_args()
+    args = make_parser().parse_args()
     main(args)
\ No newline at end of file
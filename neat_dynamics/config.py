@@ -0,0 +1,164 @@
+import argparse
+from collections import namedtuple
+import configparser
+
+def parse_config(config_file):
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    config_dict = {}
+    
+    config_dict["lr"] = float(config["DEFAULT"]["lr"])
+    config_dict["ensemble_size"] = int(config["DEFAULT"]["ensemble_size"])
+    config_dict["fused_ensemble"] = config["DEFAULT"].getboolean("fused_ensemble")
+    config_dict["memory_capacity"] = int(config["DEFAULT"]["memory_capacity"])
+    config_dict["batch_size"] = int(config["DEFAULT"]["batch_size"])
+    config_dict["prioritized_replay"] = config["DEFAULT"].getboolean("prioritized_replay")
+    config_dict["per_alpha"] = float(config["DEFAULT"]["per_alpha"])
+    config_dict["per_beta"] = float(config["DEFAULT"]["per_beta"])
+    config_dict["per_eps"] = float(config["DEFAULT"]["per_eps"])
+    config_dict["hidden_size"] = int(config["DEFAULT"]["hidden_size"])
+    config_dict["num_hidden"] = int(config["DEFAULT"]["num_hidden"])
+    config_dict["novel_threshold"] = float(config["DEFAULT"]["novel_threshold"])
+    config_dict["novelty_neighbors"] = int(config["DEFAULT"]["novelty_neighbors"])
+    config_dict["min_archive_size"] = int(config["DEFAULT"]["min_archive_size"])
+    config_dict["min_reproduce"] = int(config["DEFAULT"]["min_reproduce"])
+    config_dict["neighbor_index"] = config["DEFAULT"]["neighbor_index"]
+    config_dict["ivf_nlist"] = int(config["DEFAULT"]["ivf_nlist"])
+    config_dict["ivf_nprobe"] = int(config["DEFAULT"]["ivf_nprobe"])
+    config_dict["max_resident_orgs"] = int(config["DEFAULT"]["max_resident_orgs"])
+    config_dict["incremental_novelty"] = config["DEFAULT"].getboolean("incremental_novelty")
+    config_dict["imagination"] = config["DEFAULT"].getboolean("imagination")
+    config_dict["imagination_horizon"] = int(config["DEFAULT"]["imagination_horizon"])
+    config_dict["imagination_disagreement"] = float(config["DEFAULT"]["imagination_disagreement"])
+    config_dict["imagination_min_memory"] = int(config["DEFAULT"]["imagination_min_memory"])
+    config_dict["model_train_steps"] = int(config["DEFAULT"]["model_train_steps"])
+    config_dict["background_training"] = config["DEFAULT"].getboolean("background_training")
+    config_dict["publish_interval"] = int(config["DEFAULT"]["publish_interval"])
+    config_dict["migration_interval"] = int(config["DEFAULT"]["migration_interval"])
+    config_dict["num_migrants"] = int(config["DEFAULT"]["num_migrants"])
+    config_dict["island_threshold_spread"] = float(config["DEFAULT"]["island_threshold_spread"])
+    config_dict["racing"] = config["DEFAULT"].getboolean("racing")
+    config_dict["racing_confidence"] = float(config["DEFAULT"]["racing_confidence"])
+    config_dict["early_stop_stuck_steps"] = int(config["DEFAULT"]["early_stop_stuck_steps"])
+    config_dict["early_stop_tolerance"] = float(config["DEFAULT"]["early_stop_tolerance"])
+    config_dict["early_stop_archive_interval"] = int(config["DEFAULT"]["early_stop_archive_interval"])
+    config_dict["inference_engine"] = config["DEFAULT"].getboolean("inference_engine")
+    config_dict["inference_precision"] = config["DEFAULT"]["inference_precision"]
+    config_dict["inference_tolerance"] = float(config["DEFAULT"]["inference_tolerance"])
+
+
+
+    config = namedtuple("GenericDict", config_dict.keys())(**dict(config_dict.items()))
+
+    return config
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--init_weight_mean", type=float, default=0.0, 
+        help="Mean of initial weight")
+    parser.add_argument("--init_weight_std", type=float, default=0.4, 
+        help="Std of initial weight")
+    parser.add_argument("--weight_max", type=float, default=100.0, 
+        help="Maximum value of weight.")
+    parser.add_argument("--weight_min", type=float, default=-100.0, 
+        help="Minimum value of weight.")
+    
+    parser.add_argument("--init_bias_mean", type=float, default=0.0, 
+        help="Mean of initial bias")
+    parser.add_argument("--init_bias_std", type=float, default=0.4, 
+        help="Std of initial bias")
+    parser.add_argument("--bias_max", type=float, default=100.0, 
+        help="Maximum value of bias.")
+    parser.add_argument("--bias_min", type=float, default=-100.0, 
+        help="Minimum value of bias.")
+
+    parser.add_argument("--mutate_link_weight_rate", type=float, default=0.8, 
+        help="Probability of mutating all link weights.")
+    parser.add_argument("--mutate_link_weight_rand_rate", type=float, default=0.05, 
+        help="Likelihood of randomly initializing new link weight.")
+    parser.add_argument("--mutate_weight_power", type=float, default=0.4, 
+        help="Power of mutating a weight.")
+    parser.add_argument("--mutate_add_node_rate", type=float, default=0.15, 
+        help="Likelihood of randomly adding a new node.")
+    parser.add_argument("--mutate_add_link_rate", type=float, default=0.30, 
+        help="Likelihood of randomly adding a new link.")
+    parser.add_argument("--mutate_enable_gene", type=float, default=0.25, 
+        help="Likelihood of randomly enabling a gene.")
+    parser.add_argument("--mutate_no_crossover", type=float, default=0.1, 
+        help="Likelihood of copying a parent without crossover.")
+    parser.add_argument("--mutate_add_recur_rate", type=float, default=0.05, 
+        help="Likelihood of adding a recurrent link.")
+    parser.add_argument("--reproduce_avg_trait_rate", type=float, default=0.5, 
+        help="Likelihood of averaging the parents traits.")
+    parser.add_argument("--reproduce_interspecies_rate", type=float, default=0.001, 
+        help="Likelihood of reproducing across species.")
+
+
+    parser.add_argument("--speciate_disjoint_factor", type=float, default=1.0, 
+        help="Gene disjoint factor used for comparing two genotypes.")
+    parser.add_argument("--speciate_weight_factor", type=float, default=3.0, 
+        help="Gene trait weight factor used for comparing two genotypes.")
+    parser.add_argument("--speciate_compat_threshold", type=float, default=3.0, 
+        help="Gene trait weight factor used for comparing two genotypes.")
+    parser.add_argument("--respeciate_size", type=int, default=2, 
+        help="Size for respeciation.")
+    parser.add_argument("--max_species", type=int, default=1, 
+        help="Size for respeciation.")
+    
+
+    parser.add_argument("--population", default="compact", choices=["net", "compact"],
+        help="Population evolved, a CompactPopulation of packed genomes bred in batches or the env's networks.")
+    parser.add_argument("--init_pop_size", type=int, default=150, 
+        help="Initial population size.")
+    parser.add_argument("--survival_rate", type=float, default=0.2, 
+        help="Percentage of organisms that will survive.")
+    parser.add_argument("--env", default="cartpole", 
+        help="Environment to run..")
+    parser.add_argument("--max_stagnation", type=int, default=20,
+        help="Maximum number of stagnation generations before the species is terminated.")
+    parser.add_argument("--elites", type=int, default=2,
+        help="Number of elites to preserve if a species is terminated.")
+
+    parser.add_argument("--novelty_threshold", type=float, default=3.0,
+        help="Threshold for avg distance in novelty to be added to novelty queue.")
+    parser.add_argument("--novelty_queue_size", type=int, default=1000,
+        help="Number of novelty final states in the queue.")
+    parser.add_argument("--novelty_neighbors", type=int, default=15,
+        help="Number of novelty neighbors used to compute novelty.")
+
+
+    parser.add_argument("--save_file", default="models/population.json",
+        help="Directory to save NEAT models.")
+    parser.add_argument("--load", action="store_true",
+        help="Load existing population from save_file.")
+    parser.add_argument("--checkpoint_dir", default="models/checkpoint",
+        help="Directory of the incremental binary checkpoints, restored from with --load.")
+    parser.add_argument("--checkpoint_interval", type=int, default=0,
+        help="Number of generations between checkpoints of a CompactPopulation, 0 disables them.")
+
+    parser.add_argument("--metrics_file", default=None,
+        help="JSONL file a record of phase timings and sizes is appended to every generation.")
+    parser.add_argument("--profile_generations", type=int, nargs="*", default=[],
+        help="Generations to run under cProfile.")
+    parser.add_argument("--profile_dir", default="models/profiles",
+        help="Directory the cProfile stats of the profiled generations are dumped to.")
+
+    parser.add_argument("--phenotype_cache_size", type=int, default=1024,
+        help="Number of compiled networks each evaluator keeps for unchanged genomes, 0 disables the cache.")
+    parser.add_argument("--workers", type=int, default=1,
+        help="Number of worker processes used to evaluate the population.")
+    parser.add_argument("--eval_episodes", type=int, default=1,
+        help="Number of episodes averaged when evaluating an organism.")
+    parser.add_argument("--seed", type=int, default=None,
+        help="Seed for the episode seeds drawn by evaluation workers.")
+    parser.add_argument("--islands", type=int, default=1,
+        help="Number of island populations evolved in parallel processes.")
+    parser.add_argument("--steady_state", action="store_true",
+        help="Evolve without generation barriers on the --workers process pool.")
+    parser.add_argument("--vectorized", action="store_true",
+        help="Evaluate organisms in lockstep on a vector of environments.")
+    parser.add_argument("--num_envs", type=int, default=64,
+        help="Number of environment copies stepped together by vectorized evaluation.")
+
+    return parser
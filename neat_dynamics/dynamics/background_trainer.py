@@ -0,0 +1,99 @@
+import threading
+import torch
+from contextlib import contextmanager
+
+from neat_dynamics.dynamics.ensemble_model import make_ensemble_model
+
+class BackgroundTrainer:
+    """Trains a dynamics ensemble on its own thread while evolution runs.
+
+    Predictions come from one of two snapshot ensembles sharing the training
+    ensemble's replay memory. Every publish_interval steps the trainer copies
+    its weights into the back snapshot and swaps it to the front. A snapshot
+    is only written while no reader holds it, so readers always see one
+    consistent set of weights. Torch releases the GIL inside its kernels, so
+    fitting overlaps with reproduction and evaluation. If training fails the
+    thread stops and the error is re-raised from snapshot() and close().
+    """
+    def __init__(self, config, ac_dim, ob_dim):
+        self.config = config
+        self.ensemble = make_ensemble_model(config, ac_dim, ob_dim)
+        self.replay_memory = self.ensemble.replay_memory
+        self._buffers = [make_ensemble_model(config, ac_dim, ob_dim, self.replay_memory) for _ in range(2)]
+        self._readers = [0, 0]
+        self._front = 0
+        self._buffer_lock = threading.Lock()
+        self.num_steps = 0
+        self.num_published = 0
+        self.error = None
+        self._publish(1 - self._front)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def version(self):
+        return self.num_published
+
+    @contextmanager
+    def snapshot(self):
+        """Get the latest published ensemble, which is not overwritten until it is released."""
+        self._raise_error()
+        with self._buffer_lock:
+            idx = self._front
+            self._readers[idx] += 1
+        try:
+            yield self._buffers[idx]
+        finally:
+            with self._buffer_lock:
+                self._readers[idx] -= 1
+
+    def predict_all(self, states, actions):
+        with self.snapshot() as ensemble:
+            return ensemble.predict_all(states, actions)
+
+    def add_rollouts(self, rollouts):
+        self.ensemble.add_rollouts(rollouts)
+
+    def _publish(self, idx):
+        """Copy the training weights into snapshot idx and make it the front one."""
+        with torch.no_grad():
+            for snapshot_param, param in zip(self._buffers[idx].parameters(), self.ensemble.parameters()):
+                snapshot_param.copy_(param)
+
+        with self._buffer_lock:
+            self._front = idx
+        self.num_published += 1
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("background dynamics training failed") from self.error
+
+    def _run(self):
+        try:
+            self._train_loop()
+        except Exception as e:
+            self.error = e
+
+    def _train_loop(self):
+        batch_size = self.config.batch_size * self.config.ensemble_size
+        while not self._stop.is_set():
+            if self.replay_memory.current_capacity() < batch_size:
+                self._stop.wait(0.05)
+                continue
+
+            self.ensemble.train()
+            self.num_steps += 1
+            if self.num_steps % self.config.publish_interval == 0:
+                back = 1 - self._front
+                # Readers only ever acquire the front snapshot, so once the back one is free it stays free
+                with self._buffer_lock:
+                    back_free = self._readers[back] == 0
+                if back_free:
+                    self._publish(back)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._raise_error()
@@ -1,11 +1,11 @@
 import torch
 import torch.nn as nn
 from torch import optim
-from neat.novelty.dynamics.config import *
 
 class DynamicsModel(nn.Module):
     """Dynamics model that predicts observations and rewards."""
     def __init__(self, args, ac_dim, ob_dim):
+        super().__init__()
         self.args = args
 
         delta_layers = [nn.Linear(ob_dim + ac_dim, self.args.hidden_size), nn.ReLU()]
@@ -28,16 +28,14 @@ class DynamicsModel(nn.Module):
             
 
         self.optimizer = optim.Adam(
-            self.delta_net.parameters(),
+            self.parameters(),
             self.args.lr)
-        
-        self.loss_fn = nn.MSELoss()
     
     def forward(self, states, actions):
         cat_inp = torch.cat([states, actions], dim=1)
 
         # Get the predictions
-        latents = self.delta_net(cat_inp)
+        latents = self.delta_trunk(cat_inp)
         pred_delta = self.delta_head(latents)
         pred_reward = self.reward_head(latents)
         
@@ -48,22 +46,26 @@ class DynamicsModel(nn.Module):
         next_state_preds, _, pred_reward = self(states, actions)
         return next_state_preds, pred_reward
 
-    def update(self, states, actions, next_states, rewards):
+    def update(self, states, actions, next_states, rewards, weights=None):
+        """Take a gradient step, weighting each transition's loss if weights are given.
+
+        Returns the loss and the per-transition losses.
+        """
         # Set the target to the difference of the states
         tgts = next_states - states
 
         # Get the delta predictions
         _, pred_delta, pred_reward = self(states, actions)
 
-        loss = self.loss_fn(pred_delta, tgts)
-        loss += self.loss_fn(pred_reward, rewards)
+        # Same as the MSE of the deltas plus the MSE of the rewards, kept per transition
+        sample_losses = ((pred_delta - tgts) ** 2).mean(dim=1) + ((pred_reward - rewards) ** 2).mean(dim=1)
+        if weights is None:
+            loss = sample_losses.mean()
+        else:
+            loss = (weights * sample_losses).mean()
 
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
 
-        return loss
-        
-        
-
-
+        return loss.detach(), sample_losses.detach()
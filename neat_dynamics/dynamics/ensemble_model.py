@@ -1,44 +1,151 @@
-from dynamics_model import DynamicsModel
-from replay_memory import ReplayMemory
+import threading
+import torch
+import torch.nn.functional as F
+from contextlib import contextmanager
+
+from neat_dynamics.dynamics.dynamics_model import DynamicsModel
+from neat_dynamics.dynamics.fused_dynamics_model import FusedDynamicsModel
+from neat_dynamics.dynamics.prioritized_replay import PrioritizedReplayMemory
+from neat_dynamics.dynamics.replay_memory import ReplayMemory
 
 class EnsembleModel:
-    def __init__(self, args, ac_dim, ob_dim):
+    def __init__(self, args, ac_dim, ob_dim, replay_memory=None):
         self.args = args
-        
+        self.ac_dim = ac_dim
+        self.ob_dim = ob_dim
+        # Number of training steps taken, for consumers that cache the weights
+        self.version = 0
+
         self.dyn_models = []
         for _ in range(self.args.ensemble_size):
             self.dyn_models.append(DynamicsModel(self.args, ac_dim, ob_dim))
 
-        self.replay_memory = ReplayMemory(self.args) 
+        self.init_replay_memory(ob_dim, replay_memory)
+
+    def init_replay_memory(self, ob_dim, replay_memory):
+        """Create the replay memory unless one is shared in, memory_lock guards it against a background trainer."""
+        if replay_memory is not None:
+            self.replay_memory = replay_memory
+        elif self.args.prioritized_replay:
+            self.replay_memory = PrioritizedReplayMemory(self.args, ob_dim)
+        else:
+            self.replay_memory = ReplayMemory(self.args, ob_dim)
+        self.memory_lock = threading.Lock()
 
     def train(self):
-        states, actions, rewards, next_states = self.sample()
+        states, actions, rewards, next_states, idxs, weights = self.sample_train_batch()
         num_data = states.shape[0]
         num_data_per_model = int(num_data / self.args.ensemble_size)
         total_loss = 0
+        sample_losses = []
         for i in range(self.args.ensemble_size):
             start_idx = i * num_data_per_model
-            end_idx = (i + 1) * num_data_per_model 
-            total_loss += self.dyn_models[i].update(
+            end_idx = (i + 1) * num_data_per_model
+            loss, model_sample_losses = self.dyn_models[i].update(
                 states[start_idx:end_idx],
                 actions[start_idx:end_idx],
+                next_states[start_idx:end_idx],
                 rewards[start_idx:end_idx],
-                next_states[start_idx:end_idx])
-        
+                None if weights is None else weights[start_idx:end_idx])
+            total_loss += loss
+            sample_losses.append(model_sample_losses)
+
+        self.update_priorities(idxs, torch.cat(sample_losses))
+        self.version += 1
         return (total_loss / self.args.ensemble_size).item()
 
+    def sample_train_batch(self):
+        """Sample batch_size transitions for every member, with their indices and importance-sampling weights if prioritized."""
+        with self.memory_lock:
+            if self.args.prioritized_replay:
+                (states, actions, rewards, next_states, _), idxs, weights = self.replay_memory.sample_prioritized(
+                    self.args.batch_size * self.args.ensemble_size)
+            else:
+                states, actions, rewards, next_states, _ = self.sample(self.args.batch_size)
+                idxs, weights = None, None
+
+        actions = F.one_hot(actions, self.ac_dim).float()
+        rewards = rewards.unsqueeze(1)
+        return states, actions, rewards, next_states, idxs, weights
+
+    def update_priorities(self, idxs, sample_losses):
+        if self.args.prioritized_replay:
+            # Each transition's priority is its prediction error under the model trained on it
+            with self.memory_lock:
+                self.replay_memory.update_priorities(idxs[:len(sample_losses)], sample_losses.sqrt().numpy())
+
+    def parameters(self):
+        for dyn_model in self.dyn_models:
+            yield from dyn_model.parameters()
+
+    @contextmanager
+    def snapshot(self):
+        """Get a consistent model to predict with, the model itself when training is synchronous."""
+        yield self
+
+    def predict_all(self, states, actions):
+        """Get every member's next state and reward predictions, shaped [ensemble, batch, ...], for integer actions."""
+        actions = F.one_hot(actions, self.ac_dim).float()
+        with torch.no_grad():
+            preds = [dyn_model.predict(states, actions) for dyn_model in self.dyn_models]
+
+        return torch.stack([pred[0] for pred in preds]), torch.stack([pred[1] for pred in preds])
+
     def add_to_replay(self, exps):
-        self.replay_memory.append(exps)
-    
+        with self.memory_lock:
+            self.replay_memory.append(exps)
+
+    def add_rollouts(self, rollouts):
+        with self.memory_lock:
+            self.replay_memory.add_rollouts(rollouts)
+
     def sample(self, batch_size: int):
-        samples = self.replay_memory.sample(batch_size * self.args.ensemble_size)
-        states, actions, rewards, next_states = [], [], [], []
-        for i in range(len(samples)):
-            states.append(samples[i].state)
-            actions.append(samples[i].action)
-            rewards.append(samples[i].reward)
-            next_states.append(samples[i].next_state)
+        return self.replay_memory.sample(batch_size * self.args.ensemble_size)
+
+class FusedEnsembleModel(EnsembleModel):
+    """EnsembleModel whose members are trained together by one FusedDynamicsModel."""
+    def __init__(self, args, ac_dim, ob_dim, replay_memory=None):
+        self.args = args
+        self.ac_dim = ac_dim
+        self.ob_dim = ob_dim
+        # Number of training steps taken, for consumers that cache the weights
+        self.version = 0
+        self.dyn_model = FusedDynamicsModel(self.args, ac_dim, ob_dim)
+        self.init_replay_memory(ob_dim, replay_memory)
+
+    def train(self):
+        states, actions, rewards, next_states, idxs, weights = self.sample_train_batch()
+
+        # Member i trains on the i-th slice of the batch, as in EnsembleModel
+        ensemble_size = self.args.ensemble_size
+        num_data_per_model = int(states.shape[0] / ensemble_size)
+        num_data = num_data_per_model * ensemble_size
+        stack = lambda x: x[:num_data].reshape(ensemble_size, num_data_per_model, *x.shape[1:])
+
+        losses, sample_losses = self.dyn_model.update(
+            stack(states),
+            stack(actions),
+            stack(next_states),
+            stack(rewards),
+            None if weights is None else stack(weights))
+
+        self.update_priorities(idxs, sample_losses.reshape(-1))
+        self.version += 1
+        return losses.mean().item()
+
+    def predict_all(self, states, actions):
+        """Get every member's next state and reward predictions, shaped [ensemble, batch, ...], for integer actions."""
+        actions = F.one_hot(actions, self.ac_dim).float()
+        ensemble_size = self.args.ensemble_size
+        with torch.no_grad():
+            return self.dyn_model.predict(
+                states.expand(ensemble_size, *states.shape),
+                actions.expand(ensemble_size, *actions.shape))
 
-        return states, actions, rewards, next_states
+    def parameters(self):
+        return self.dyn_model.parameters()
 
-        
\ No newline at end of file
+def make_ensemble_model(args, ac_dim, ob_dim, replay_memory=None):
+    if args.fused_ensemble:
+        return FusedEnsembleModel(args, ac_dim, ob_dim, replay_memory)
+    return EnsembleModel(args, ac_dim, ob_dim, replay_memory)
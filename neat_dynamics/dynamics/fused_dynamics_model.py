@@ -0,0 +1,92 @@
+import math
+import torch
+import torch.nn as nn
+from torch import optim
+
+class EnsembleLinear(nn.Module):
+    """Linear layer of every ensemble member, with weights stacked as [ensemble, in, out]."""
+    def __init__(self, ensemble_size, in_features, out_features):
+        super().__init__()
+        self.weight = nn.Parameter(torch.empty(ensemble_size, in_features, out_features))
+        self.bias = nn.Parameter(torch.empty(ensemble_size, 1, out_features))
+
+        # Same initialization as nn.Linear, drawn separately for every member
+        bound = 1 / math.sqrt(in_features)
+        nn.init.uniform_(self.weight, -bound, bound)
+        nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x):
+        # [ensemble, batch, in] @ [ensemble, in, out] + [ensemble, 1, out]
+        return torch.baddbmm(self.bias, x, self.weight)
+
+class FusedDynamicsModel(nn.Module):
+    """All members of a dynamics ensemble in one module.
+
+    Each member has the architecture of DynamicsModel, and inputs carry a
+    leading ensemble dimension so every layer is a single batched matmul.
+    Adam works elementwise, so one optimizer over the stacked weights updates
+    every member exactly as its own optimizer would.
+    """
+    def __init__(self, args, ac_dim, ob_dim):
+        super().__init__()
+        self.args = args
+        ensemble_size = self.args.ensemble_size
+
+        delta_layers = [EnsembleLinear(ensemble_size, ob_dim + ac_dim, self.args.hidden_size), nn.ReLU()]
+        for i in range(self.args.num_hidden):
+            delta_layers.append(EnsembleLinear(ensemble_size, self.args.hidden_size, self.args.hidden_size))
+            delta_layers.append(nn.ReLU())
+        self.delta_trunk = nn.Sequential(*delta_layers)
+
+        self.delta_head = nn.Sequential(
+            EnsembleLinear(ensemble_size, self.args.hidden_size, self.args.hidden_size),
+            nn.ReLU(),
+            EnsembleLinear(ensemble_size, self.args.hidden_size, ob_dim))
+
+        self.reward_head = nn.Sequential(
+            EnsembleLinear(ensemble_size, self.args.hidden_size, self.args.hidden_size),
+            nn.ReLU(),
+            EnsembleLinear(ensemble_size, self.args.hidden_size, 1))
+
+        self.optimizer = optim.Adam(
+            self.parameters(),
+            self.args.lr)
+
+    def forward(self, states, actions):
+        cat_inp = torch.cat([states, actions], dim=-1)
+
+        # Get the predictions
+        latents = self.delta_trunk(cat_inp)
+        pred_delta = self.delta_head(latents)
+        pred_reward = self.reward_head(latents)
+
+        next_state_preds = pred_delta + states
+        return next_state_preds, pred_delta, pred_reward
+
+    def predict(self, states, actions):
+        next_state_preds, _, pred_reward = self(states, actions)
+        return next_state_preds, pred_reward
+
+    def update(self, states, actions, next_states, rewards, weights=None):
+        """Take a gradient step for every member on its own [ensemble, batch, ...] slice.
+
+        Returns the loss of every member and the per-transition losses.
+        """
+        # Set the target to the difference of the states
+        tgts = next_states - states
+
+        # Get the delta predictions
+        _, pred_delta, pred_reward = self(states, actions)
+
+        sample_losses = ((pred_delta - tgts) ** 2).mean(dim=2) + ((pred_reward - rewards) ** 2).mean(dim=2)
+        if weights is None:
+            member_losses = sample_losses.mean(dim=1)
+        else:
+            member_losses = (weights * sample_losses).mean(dim=1)
+
+        # Members share no weights, so the gradient of the sum is each member's own gradient
+        self.optimizer.zero_grad()
+        member_losses.sum().backward()
+        self.optimizer.step()
+
+        return member_losses.detach(), sample_losses.detach()
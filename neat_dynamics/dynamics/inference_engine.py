@@ -0,0 +1,172 @@
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from contextlib import contextmanager
+
+from neat_dynamics.dynamics.fused_dynamics_model import EnsembleLinear
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+
+# Number of replay states reduced-precision predictions are checked on
+VERIFY_SAMPLES = 256
+
+class _MemberPredictor(nn.Module):
+    """Prediction layers of one dynamics model, without its optimizer."""
+    def __init__(self, delta_trunk, delta_head, reward_head):
+        super().__init__()
+        self.delta_trunk = delta_trunk
+        self.delta_head = delta_head
+        self.reward_head = reward_head
+
+    def forward(self, states, actions):
+        latents = self.delta_trunk(torch.cat([states, actions], dim=-1))
+        return self.delta_head(latents) + states, self.reward_head(latents)
+
+class _EnsemblePredictor(nn.Module):
+    def __init__(self, members):
+        super().__init__()
+        self.members = nn.ModuleList(members)
+
+    def forward(self, states, actions):
+        preds = [member(states, actions) for member in self.members]
+        return torch.stack([pred[0] for pred in preds]), torch.stack([pred[1] for pred in preds])
+
+class _FusedPredictor(_MemberPredictor):
+    def __init__(self, ensemble_size, delta_trunk, delta_head, reward_head):
+        super().__init__(delta_trunk, delta_head, reward_head)
+        self.ensemble_size = ensemble_size
+
+    def forward(self, states, actions):
+        return super().forward(
+            states.expand(self.ensemble_size, *states.shape),
+            actions.expand(self.ensemble_size, *actions.shape))
+
+def _unfuse(layers, member):
+    """Get one member's layers out of a sequence of EnsembleLinear layers as plain nn.Linear."""
+    unfused = []
+    for layer in layers:
+        if isinstance(layer, EnsembleLinear):
+            linear = nn.Linear(layer.weight.shape[1], layer.weight.shape[2])
+            linear.weight.data.copy_(layer.weight.data[member].T)
+            linear.bias.data.copy_(layer.bias.data[member, 0])
+            unfused.append(linear)
+        else:
+            unfused.append(copy.deepcopy(layer))
+
+    return nn.Sequential(*unfused)
+
+class InferenceEngine:
+    """Frozen, traced predictor for an ensemble, rebuilt when its weights change.
+
+    The predictor copies only the prediction layers, runs without autograd and
+    optionally in bf16 or with int8 dynamic quantization of the linear layers.
+    Fused ensembles are unfused for int8, which only covers nn.Linear. A
+    reduced-precision predictor whose error on replay states exceeds
+    inference_tolerance, relative to the fp32 model, is replaced by the fp32 one.
+    Wraps an EnsembleModel or a BackgroundTrainer and checks its version on
+    every snapshot. The precision in use and its measured error are recorded
+    in metrics on every rebuild.
+    """
+    def __init__(self, config, source):
+        self.config = config
+        self.source = source
+        self.replay_memory = source.replay_memory
+        self.precision = config.inference_precision
+        self.predictor = None
+        self.version = None
+        # Error of the last reduced-precision predictor checked, None when it was not checked
+        self.error = None
+        self.metrics = GenerationMetrics()
+
+    @contextmanager
+    def snapshot(self):
+        """Get the engine, refreshed if the source published new weights."""
+        if self.version != self.source.version:
+            self.refresh()
+        yield self
+
+    def refresh(self):
+        with self.source.snapshot() as ensemble:
+            self.version = self.source.version
+            self.ac_dim = ensemble.ac_dim
+            self.precision = self.config.inference_precision
+            self.predictor = self.build(ensemble, self.precision)
+            self.error = None
+
+            if self.precision != "fp32" and self.replay_memory.current_capacity() > 0:
+                states, actions, _, _, _ = self.replay_memory.sample(
+                    min(VERIFY_SAMPLES, self.replay_memory.current_capacity()))
+                self.error = self.prediction_error(ensemble, states, actions)
+                if self.error > self.config.inference_tolerance:
+                    self.precision = "fp32"
+                    self.predictor = self.build(ensemble, self.precision)
+
+        self.metrics.set(inference_precision=self.precision, inference_error=self.error)
+
+    def build(self, ensemble, precision):
+        """Build a frozen predictor from the ensemble's current weights."""
+        if hasattr(ensemble, "dyn_model") and precision != "int8":
+            model = ensemble.dyn_model
+            predictor = _FusedPredictor(
+                self.config.ensemble_size,
+                copy.deepcopy(model.delta_trunk),
+                copy.deepcopy(model.delta_head),
+                copy.deepcopy(model.reward_head))
+        elif hasattr(ensemble, "dyn_model"):
+            model = ensemble.dyn_model
+            predictor = _EnsemblePredictor([
+                _MemberPredictor(
+                    _unfuse(model.delta_trunk, i),
+                    _unfuse(model.delta_head, i),
+                    _unfuse(model.reward_head, i))
+                for i in range(self.config.ensemble_size)])
+        else:
+            predictor = _EnsemblePredictor([
+                _MemberPredictor(
+                    copy.deepcopy(model.delta_trunk),
+                    copy.deepcopy(model.delta_head),
+                    copy.deepcopy(model.reward_head))
+                for model in ensemble.dyn_models])
+
+        predictor.eval()
+        predictor.requires_grad_(False)
+        if precision == "int8":
+            predictor = torch.ao.quantization.quantize_dynamic(predictor, {nn.Linear}, dtype=torch.qint8)
+        elif precision == "bf16":
+            predictor = predictor.to(torch.bfloat16)
+        elif precision != "fp32":
+            raise ValueError("Unknown inference precision " + precision)
+
+        example = (
+            torch.zeros((1, ensemble.ob_dim), dtype=self.input_dtype(precision)),
+            torch.zeros((1, ensemble.ac_dim), dtype=self.input_dtype(precision)))
+        with torch.no_grad():
+            return torch.jit.trace(predictor, example, check_trace=False)
+
+    def input_dtype(self, precision):
+        return torch.bfloat16 if precision == "bf16" else torch.float32
+
+    def predict_all(self, states, actions):
+        """Get every member's next state and reward predictions, shaped [ensemble, batch, ...], for integer actions."""
+        dtype = self.input_dtype(self.precision)
+        actions = F.one_hot(actions, self.ac_dim).to(dtype)
+        with torch.inference_mode():
+            next_state_preds, reward_preds = self.predictor(states.to(dtype), actions)
+        return next_state_preds.float(), reward_preds.float()
+
+    def prediction_error(self, ensemble, states, actions):
+        """Get the largest error of the predictor against the fp32 ensemble, relative to the largest fp32 prediction."""
+        ref_next_states, ref_rewards = ensemble.predict_all(states, actions)
+        next_states, rewards = self.predict_all(states, actions)
+        return max(
+            ((next_states - ref_next_states).abs().max() / (ref_next_states.abs().max() + 1e-6)).item(),
+            ((rewards - ref_rewards).abs().max() / (ref_rewards.abs().max() + 1e-6)).item())
+
+    def add_rollouts(self, rollouts):
+        self.source.add_rollouts(rollouts)
+
+    def train(self):
+        return self.source.train()
+
+    def close(self):
+        self.source.close()
@@ -0,0 +1,112 @@
+import torch
+import numpy as np
+
+from neat_dynamics.dynamics.replay_memory import ReplayMemory
+
+
+class SumTree:
+    """Binary tree where every node holds the sum of the priorities of the leaves under it.
+
+    Node 1 is the root and leaf i sits at node num_leaves + i. Updates and
+    samples walk one root-to-leaf path per transition, and a batch walks all
+    its paths together one level at a time.
+    """
+    def __init__(self, capacity):
+        self.num_leaves = 1 << max(int(capacity - 1).bit_length(), 0)
+        self.tree = np.zeros(2 * self.num_leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idxs):
+        return self.tree[idxs + self.num_leaves]
+
+    def update(self, idxs, priorities):
+        """Set the priorities of leaves and recompute the sums above them."""
+        if len(idxs) == 0:
+            return
+
+        nodes = np.asarray(idxs) + self.num_leaves
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        # Every path reaches node 0, the unused slot above the root, at the same time
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """Get the leaf whose priority interval holds each value in [0, total)."""
+        values = np.array(values, dtype=np.float64)
+        if len(values) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.num_leaves:
+            left_sums = self.tree[2 * nodes]
+            go_right = values >= left_sums
+            values -= np.where(go_right, left_sums, 0.0)
+            nodes = 2 * nodes + go_right
+
+        return nodes - self.num_leaves
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """Replay memory that samples transitions in proportion to their prediction error.
+
+    New transitions get the largest priority seen so far so each is trained
+    on at least once. Samples come with importance-sampling weights that
+    undo the bias of non-uniform sampling in the loss.
+    """
+    def __init__(self, args, ob_dim):
+        super().__init__(args, ob_dim)
+        self._tree = SumTree(self._args.memory_capacity)
+        self._max_priority = 1.0
+
+    def append(self, e_t):
+        """Append experience."""
+        pos = self._cur_pos
+        super().append(e_t)
+        self._tree.update(np.array([pos]), self._max_priority)
+
+    def add_transitions(self, states, actions, rewards, next_states, dones):
+        """Append a batch of transitions, each with the current maximum priority."""
+        num_exps = min(len(actions), self._args.memory_capacity)
+        idxs = (self._cur_pos + np.arange(num_exps)) % self._args.memory_capacity
+        super().add_transitions(states, actions, rewards, next_states, dones)
+        self._tree.update(idxs, self._max_priority)
+
+    def sample_prioritized(self, batch_size):
+        """Sample batch size experience replay in proportion to priority.
+
+        Returns the stacked transitions, their indices and their importance-sampling weights.
+        """
+        # One draw from each of batch_size equal slices of the priority mass
+        total = self._tree.total()
+        values = (np.arange(batch_size) + self._rng.random(batch_size)) * (total / batch_size)
+        idxs = np.minimum(self._tree.find(values), self._size - 1)
+        # Draws come out in tree order, shuffle so consecutive slices of the batch are alike
+        self._rng.shuffle(idxs)
+
+        # A priority of zero would give an infinite weight, floor it at the least any error gets
+        min_priority = max(self._args.per_eps ** self._args.per_alpha, np.finfo(np.float64).tiny)
+        probs = np.maximum(self._tree.get(idxs), min_priority) / total
+        weights = (self._size * probs) ** -self._args.per_beta
+        weights /= weights.max()
+
+        torch_idxs = torch.from_numpy(idxs)
+        batch = (
+            self._states[torch_idxs],
+            self._actions[torch_idxs],
+            self._rewards[torch_idxs],
+            self._next_states[torch_idxs],
+            self._dones[torch_idxs])
+        return batch, idxs, torch.as_tensor(weights, dtype=torch.float32)
+
+    def update_priorities(self, idxs, errors):
+        """Set the priorities of sampled transitions from their prediction errors."""
+        if len(idxs) == 0:
+            return
+
+        priorities = (np.asarray(errors, dtype=np.float64) + self._args.per_eps) ** self._args.per_alpha
+        self._tree.update(idxs, priorities)
+        self._max_priority = max(self._max_priority, float(priorities.max()))
@@ -1,32 +1,90 @@
 import torch
-import random
 import numpy as np
 
 
 class ReplayMemory:
-    def __init__(self, args):
+    """Ring buffer of transitions stored as preallocated tensors, one per field."""
+    def __init__(self, args, ob_dim):
         self._args = args
-        self._memory = []
+        capacity = self._args.memory_capacity
+        self._states = torch.zeros((capacity, ob_dim), dtype=torch.float32)
+        self._actions = torch.zeros(capacity, dtype=torch.int64)
+        self._rewards = torch.zeros(capacity, dtype=torch.float32)
+        self._next_states = torch.zeros((capacity, ob_dim), dtype=torch.float32)
+        self._dones = torch.zeros(capacity, dtype=torch.bool)
+        self._rng = np.random.default_rng()
+
         # Pointer to end of memory
         self._cur_pos = 0
-    
+        self._size = 0
+        # Transitions ever appended, including overwritten ones
+        self.num_added = 0
+
     def append(self, e_t):
         """Append experience."""
-        if len(self._memory) >= self._args.memory_capacity:
-            self._memory[self._cur_pos] = e_t
-        else:
-            self._memory.append(e_t)
-        
+        self._states[self._cur_pos] = torch.as_tensor(e_t.state)
+        self._actions[self._cur_pos] = e_t.action
+        self._rewards[self._cur_pos] = e_t.reward
+        if e_t.next_state is not None:
+            self._next_states[self._cur_pos] = torch.as_tensor(e_t.next_state)
+        self._dones[self._cur_pos] = e_t.done
+
         # Update end of memory
-        self._cur_pos = (self._cur_pos + 1) %  self._args.memory_capacity 
-    
-    def add_rollouts(self, exps):
-        for exp in exps:
-            self.append(exp)
+        self._cur_pos = (self._cur_pos + 1) %  self._args.memory_capacity
+        self._size = min(self._size + 1, self._args.memory_capacity)
+        self.num_added += 1
+
+    def add_transitions(self, states, actions, rewards, next_states, dones):
+        """Append a batch of transitions with slice writes, wrapping around the end of memory."""
+        num_exps = len(actions)
+        self.num_added += num_exps
+        capacity = self._args.memory_capacity
+        # Only the newest transitions survive a batch larger than memory
+        start = max(num_exps - capacity, 0)
+        fields = [
+            (self._states, torch.as_tensor(states[start:], dtype=torch.float32)),
+            (self._actions, torch.as_tensor(actions[start:], dtype=torch.int64)),
+            (self._rewards, torch.as_tensor(rewards[start:], dtype=torch.float32)),
+            (self._next_states, torch.as_tensor(next_states[start:], dtype=torch.float32)),
+            (self._dones, torch.as_tensor(dones[start:], dtype=torch.bool))]
+
+        num_exps -= start
+        num_tail = min(num_exps, capacity - self._cur_pos)
+        for buffer, values in fields:
+            buffer[self._cur_pos:self._cur_pos + num_tail] = values[:num_tail]
+            buffer[:num_exps - num_tail] = values[num_tail:]
+
+        self._cur_pos = (self._cur_pos + num_exps) % capacity
+        self._size = min(self._size + num_exps, capacity)
+
+    def add_rollouts(self, rollouts):
+        """Append the transitions of every rollout."""
+        for rollout in rollouts:
+            self.add_transitions(rollout.states, rollout.actions, rollout.rewards, rollout.next_states, rollout.dones)
+
+    def latest(self, num_exps):
+        """Get the last num_exps transitions in the order they were added, as NumPy arrays."""
+        num_exps = min(num_exps, self._size)
+        idxs = torch.from_numpy((self._cur_pos - num_exps + np.arange(num_exps)) % self._args.memory_capacity)
+        return (
+            self._states[idxs].numpy(),
+            self._actions[idxs].numpy(),
+            self._rewards[idxs].numpy(),
+            self._next_states[idxs].numpy(),
+            self._dones[idxs].numpy())
 
     def sample(self, batch_size):
-        """Sample batch size experience replay."""
-        return np.random.choice(self._memory, size=batch_size, replace=False)
+        """Sample batch size experience replay.
+
+        Returns stacked states, actions, rewards, next states and done flags.
+        """
+        idxs = torch.from_numpy(self._rng.choice(self._size, size=batch_size, replace=False))
+        return (
+            self._states[idxs],
+            self._actions[idxs],
+            self._rewards[idxs],
+            self._next_states[idxs],
+            self._dones[idxs])
 
     def current_capacity(self):
-        return len(self._memory)
\ No newline at end of file
+        return self._size
@@ -0,0 +1,65 @@
+import numpy as np
+
+from neat_dynamics.evaluation.rollout import skill_descriptor
+
+class RolloutController:
+    """Decides when an episode can end before its limit and counts the steps that saves.
+
+    An episode stops once its state has changed by at most
+    early_stop_tolerance in every dimension for early_stop_stuck_steps steps
+    in a row. Given the archive, every early_stop_archive_interval steps it
+    also stops once the member nearest its current descriptor lies within
+    novel_threshold and is at least as fit as the return so far plus the
+    spec's bound on the return still to come. The archive stores final
+    states, so this takes the episode to end near where it is; a dense
+    region alone never stops it, since the episode may still move out of
+    it. A stopped episode's return is truncated at the stop and is what the
+    organism's avg_fitness is computed from. Steps saved count up to the
+    episode limit, so they bound the saving from above.
+    """
+    def __init__(self, config, spec, archive=None):
+        self.stuck_steps = config.early_stop_stuck_steps
+        self.tolerance = config.early_stop_tolerance
+        self.archive_interval = config.early_stop_archive_interval
+        self.spec = spec
+        # Pool workers have no archive and only stop stuck episodes
+        self.archive = archive if spec.return_bound is not None else None
+        self.steps_saved = 0
+        self.episodes_stopped = 0
+
+    def episode(self):
+        return EpisodeMonitor(self)
+
+    def record(self, results):
+        """Count the steps saved in a batch of rollout results, which may come from other processes."""
+        for result in results:
+            self.steps_saved += result.steps_saved
+            self.episodes_stopped += result.episodes_stopped
+
+class EpisodeMonitor:
+    """Watches one episode for the point it can stop early."""
+    __slots__ = ("controller", "prev_state", "still_steps")
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.prev_state = None
+        self.still_steps = 0
+
+    def stop(self, step, state, total_reward):
+        """Get whether the episode can end after step steps, reaching state with total_reward."""
+        controller = self.controller
+        if controller.stuck_steps > 0:
+            if self.prev_state is not None and np.max(np.abs(state - self.prev_state)) <= controller.tolerance:
+                self.still_steps += 1
+            else:
+                self.still_steps = 0
+            self.prev_state = state
+            if self.still_steps >= controller.stuck_steps:
+                return True
+
+        if controller.archive is not None and controller.archive_interval > 0 and step % controller.archive_interval == 0:
+            spec = controller.spec
+            upper = total_reward + spec.return_bound(state, spec.max_steps - step)
+            return controller.archive.outclassed(skill_descriptor(spec, state), upper)
+
+        return False
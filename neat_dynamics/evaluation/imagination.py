@@ -0,0 +1,129 @@
+import numpy as np
+import torch
+
+from neat_dynamics.evaluation.rollout import GenomeCache, RolloutResult, episode_starts, skill_descriptor
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+from neat_dynamics.neat.phenotype import BatchedNetwork
+
+# Number of most recent real episode start states imagined rollouts begin from
+MAX_START_STATES = 4096
+
+class ImaginationEvaluator:
+    """Scores organisms with rollouts imagined by the dynamics ensemble.
+
+    Every organism's policy is rolled forward from real episode start states
+    inside the ensemble, stepping on the mean next-state prediction and
+    summing the mean reward prediction. Organisms whose rollouts the members
+    disagree on more than imagination_disagreement, measured as the mean
+    per-step std of the predicted next states, are rolled out for real. Real
+    rollouts feed the replay memory and the ensemble is trained after each
+    generation, unless a BackgroundTrainer is fitting it concurrently.
+    """
+    def __init__(self, args, config, spec, ensemble, real_evaluator):
+        self.args = args
+        self.config = config
+        self.spec = spec
+        self.ensemble = ensemble
+        self.real_evaluator = real_evaluator
+        self.num_inputs = real_evaluator.num_inputs
+        self.num_outputs = real_evaluator.num_outputs
+        self.genomes = GenomeCache(args.phenotype_cache_size, self.num_inputs, self.num_outputs)
+        self.start_states = np.empty((0, self.num_inputs), dtype=np.float32)
+        self.rng = np.random.default_rng(args.seed)
+        # Replaced by the run's recorder to write the training time out
+        self.metrics = GenerationMetrics()
+
+    def evaluate(self, orgs):
+        """Score every organism, set its avg_fitness and get the rollout results in order."""
+        # Imagined episodes start from real ones, a replay memory restored from a checkpoint can come without any
+        if self.ensemble.replay_memory.current_capacity() < self.config.imagination_min_memory or len(self.start_states) == 0:
+            results = self.real_evaluator.evaluate(orgs)
+            self.learn(results)
+            return results
+
+        results, disagreements = self.imagine(orgs)
+        real_idxs = np.flatnonzero(disagreements > self.config.imagination_disagreement)
+        real_results = self.real_evaluator.evaluate([orgs[i] for i in real_idxs])
+        for i, result in zip(real_idxs, real_results):
+            results[i] = result
+
+        for org, result in zip(orgs, results):
+            org.avg_fitness = result.fitness
+
+        self.metrics.set(imagined=len(orgs) - len(real_idxs), real_rollouts=len(real_idxs))
+        self.learn(real_results)
+        return results
+
+    def imagine(self, orgs):
+        """Roll out every organism inside the ensemble and get the results and mean per-step disagreements."""
+        num_orgs = len(orgs)
+        num_episodes = self.args.eval_episodes
+        genomes = [self.genomes.get(org) for org in orgs]
+        # Row j runs episode j // num_orgs of organism j % num_orgs
+        net = BatchedNetwork(genomes * num_episodes)
+        states = self.start_states[self.rng.integers(len(self.start_states), size=num_orgs * num_episodes)]
+
+        active = np.ones(len(states), dtype=bool)
+        returns = np.zeros(len(states))
+        total_disagreement = np.zeros(len(states))
+        num_steps = np.zeros(len(states))
+        # A horizon of 0 imagines as long as a real episode, so imagined and real fitnesses share a scale
+        horizon = min(self.config.imagination_horizon or self.spec.max_steps, self.spec.max_steps)
+        # One snapshot for the whole rollout, a background trainer may publish new weights meanwhile
+        with self.ensemble.snapshot() as ensemble:
+            for _ in range(horizon):
+                actions = np.argmax(net.activate(states), axis=1)
+                next_state_preds, reward_preds = ensemble.predict_all(
+                    torch.from_numpy(states), torch.from_numpy(actions))
+                next_state_preds = next_state_preds.numpy()
+
+                returns[active] += reward_preds.numpy().mean(axis=0)[active, 0]
+                total_disagreement[active] += next_state_preds.std(axis=0).mean(axis=1)[active]
+                num_steps[active] += 1
+                states[active] = next_state_preds.mean(axis=0)[active]
+
+                if self.spec.done_fn is not None:
+                    active &= ~self.spec.done_fn(states)
+                if not active.any():
+                    break
+
+        fitnesses = returns.reshape(num_episodes, num_orgs).mean(axis=0)
+        disagreements = (total_disagreement / np.maximum(num_steps, 1)).reshape(num_episodes, num_orgs).mean(axis=0)
+        descriptors = np.stack([skill_descriptor(self.spec, state) for state in states])
+        descriptors = descriptors.reshape(num_episodes, num_orgs, -1).mean(axis=0)
+
+        empty_states = np.empty((0, self.num_inputs), dtype=np.float32)
+        results = []
+        for i in range(num_orgs):
+            results.append(RolloutResult(
+                float(fitnesses[i]),
+                descriptors[i],
+                empty_states,
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float32),
+                empty_states,
+                np.empty(0, dtype=bool),
+                imagined=True))
+
+        return results, disagreements
+
+    def learn(self, results):
+        """Add real rollouts to the replay memory and start states, then train the ensemble."""
+        self.ensemble.add_rollouts(results)
+        starts = [episode_starts(result) for result in results]
+        self.start_states = np.concatenate([self.start_states] + starts)[-MAX_START_STATES:]
+
+        # A background trainer fits the ensemble on its own
+        if self.config.background_training:
+            return
+
+        batch_size = self.config.batch_size * self.config.ensemble_size
+        if self.ensemble.replay_memory.current_capacity() >= batch_size:
+            with self.metrics.phase("model_training"):
+                for _ in range(self.config.model_train_steps):
+                    self.ensemble.train()
+
+    def close(self):
+        if self.config.background_training:
+            self.ensemble.close()
+        self.real_evaluator.close()
@@ -0,0 +1,83 @@
+import multiprocessing
+import numpy as np
+
+from neat_dynamics.evaluation.rollout import GenomeCache, env_dims, make_env, rollout
+from neat_dynamics.neat.phenotype import PhenotypeCache
+
+# Per-process state of a pool worker, kept warm across generations
+_worker_env = None
+_worker_spec = None
+_worker_rng = None
+_worker_episodes = None
+_worker_phenotypes = None
+_worker_controller = None
+
+def _init_worker(spec, num_episodes, phenotype_cache_size, controller, entropy, worker_counter):
+    global _worker_env, _worker_spec, _worker_rng, _worker_episodes, _worker_phenotypes, _worker_controller
+    _worker_env = make_env(spec)
+    _worker_spec = spec
+    # Workers the pool starts to replace dead ones count on past the first num_workers and get fresh seeds
+    with worker_counter.get_lock():
+        worker_idx = worker_counter.value
+        worker_counter.value += 1
+    # The same seed as SeedSequence(entropy).spawn(n)[worker_idx]
+    _worker_rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(worker_idx,)))
+    _worker_episodes = num_episodes
+    # Genomes keep their structure number and version through pickling, so they key the worker's cache
+    _worker_phenotypes = PhenotypeCache(phenotype_cache_size)
+    _worker_controller = controller
+
+def _eval_genome(genome):
+    return rollout(_worker_env, _worker_phenotypes.get(genome), _worker_spec, _worker_rng, _worker_episodes, _worker_controller)
+
+class ParallelEvaluator:
+    """Evaluates organisms on a persistent process pool.
+
+    Organisms are shipped as compact genomes. Each worker builds its gym
+    environment once and keeps it for the whole run, and draws episode seeds
+    from its own RNG spawned off args.seed.
+    """
+    def __init__(self, args, spec, controller=None):
+        self.args = args
+        self.spec = spec
+        self.num_workers = args.workers
+        # Workers stop episodes with their own copy, the saved steps come back with the results
+        self.controller = controller
+
+        env = make_env(spec)
+        self.num_inputs, self.num_outputs = env_dims(env)
+        env.close()
+        self.genomes = GenomeCache(args.phenotype_cache_size, self.num_inputs, self.num_outputs)
+
+        # Drawn once here so every worker spawns off the same entropy when args.seed is None
+        entropy = np.random.SeedSequence(args.seed).entropy
+        self.pool = multiprocessing.Pool(
+            self.num_workers,
+            initializer=_init_worker,
+            initargs=(spec, args.eval_episodes, args.phenotype_cache_size, controller, entropy, multiprocessing.Value("i", 0)))
+
+    def evaluate(self, orgs):
+        """Roll out every organism, set its avg_fitness and get the rollout results in order."""
+        genomes = [self.genomes.get(org) for org in orgs]
+        # A few chunks per worker balances uneven episode lengths against IPC overhead
+        chunksize = max(len(genomes) // (4 * self.num_workers), 1)
+        results = self.pool.map(_eval_genome, genomes, chunksize=chunksize)
+
+        for org, result in zip(orgs, results):
+            org.avg_fitness = result.fitness
+        if self.controller is not None:
+            self.controller.record(results)
+        return results
+
+    def submit(self, org, callback, error_callback):
+        """Roll out one organism asynchronously, callback(org, result) runs on the pool's result thread."""
+        genome = self.genomes.get(org)
+        self.pool.apply_async(
+            _eval_genome,
+            (genome,),
+            callback=lambda result: callback(org, result),
+            error_callback=error_callback)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,94 @@
+import numpy as np
+
+from neat_dynamics.evaluation.rollout import RolloutResult
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+
+def merge_results(results):
+    """Get one result averaging the fitness and descriptor of several episodes and holding all their transitions."""
+    return RolloutResult(
+        float(np.mean([result.fitness for result in results])),
+        np.mean([result.skill_descriptor for result in results], axis=0),
+        np.concatenate([result.states for result in results]),
+        np.concatenate([result.actions for result in results]),
+        np.concatenate([result.rewards for result in results]),
+        np.concatenate([result.next_states for result in results]),
+        np.concatenate([result.dones for result in results]),
+        episodes_stopped=sum(result.episodes_stopped for result in results),
+        steps_saved=sum(result.steps_saved for result in results))
+
+class RacingEvaluator:
+    """Spends episodes only on the organisms that could still enter the archive.
+
+    Every organism is first rolled out for one episode, then rounds double the
+    episodes of the survivors until they reach eval_episodes. An organism
+    survives a round if the archive would admit it at its mean skill
+    descriptor with the upper confidence bound of its return,
+    mean + racing_confidence * std / sqrt(episodes), as its fitness. Only
+    archive members are drawn as parents, so an organism that cannot enter
+    keeps the estimate it has, while members already in the archive always
+    get the full budget. Until an organism has a second episode its std is
+    the spread of the first round's returns. Between rounds every organism's
+    avg_fitness holds its mean return so far and an archive member's the
+    fitness it entered the race with, the archive compares against those
+    rather than the single episodes the inner evaluator sets.
+    """
+    def __init__(self, args, config, evaluator, archive):
+        self.args = args
+        self.config = config
+        # Rolls out one episode per organism it is given
+        self.evaluator = evaluator
+        self.archive = archive
+        self.num_inputs = evaluator.num_inputs
+        self.num_outputs = evaluator.num_outputs
+        # Replaced by the run's recorder to write the episode counts out
+        self.metrics = GenerationMetrics()
+
+    def evaluate(self, orgs):
+        """Race the organisms, set their avg_fitness and get the merged rollout results in order."""
+        member_fitness = {i: org.avg_fitness for i, org in enumerate(orgs) if org.id in self.archive.novel_archive}
+        episodes = [[result] for result in self.evaluator.evaluate(orgs)]
+        self.restore_fitness(orgs, episodes, member_fitness)
+        first_std = float(np.std([org_episodes[0].fitness for org_episodes in episodes]))
+
+        racers = list(range(len(orgs)))
+        num_episodes = 1
+        while num_episodes < self.args.eval_episodes:
+            racers = [i for i in racers if self.plausible(orgs[i], episodes[i], first_std)]
+            if len(racers) == 0:
+                break
+
+            # Every racer's new episodes go out as one batch
+            num_new = min(num_episodes, self.args.eval_episodes - num_episodes)
+            results = self.evaluator.evaluate([orgs[i] for i in racers] * num_new)
+            for j, result in enumerate(results):
+                episodes[racers[j % len(racers)]].append(result)
+            self.restore_fitness(orgs, episodes, member_fitness)
+            num_episodes += num_new
+
+        results = [merge_results(org_episodes) for org_episodes in episodes]
+        for org, result in zip(orgs, results):
+            org.avg_fitness = result.fitness
+
+        self.metrics.set(
+            racing_episodes=sum(len(org_episodes) for org_episodes in episodes),
+            racing_full_episodes=len(orgs) * self.args.eval_episodes,
+            racing_steps=sum(len(result.actions) for result in results))
+        return results
+
+    def restore_fitness(self, orgs, episodes, member_fitness):
+        """Set avg_fitness back to each organism's mean return so far, or to an archive member's fitness before the race."""
+        for i, org in enumerate(orgs):
+            org.avg_fitness = member_fitness.get(i, float(np.mean([result.fitness for result in episodes[i]])))
+
+    def plausible(self, org, org_episodes, first_std):
+        """Get whether an organism is an archive member or could enter the archive with its return at the upper confidence bound."""
+        if org.id in self.archive.novel_archive:
+            return True
+
+        fitnesses = [result.fitness for result in org_episodes]
+        std = np.std(fitnesses, ddof=1) if len(fitnesses) > 1 else first_std
+        upper = np.mean(fitnesses) + self.config.racing_confidence * std / np.sqrt(len(fitnesses))
+        return self.archive.would_admit(np.mean([result.skill_descriptor for result in org_episodes], axis=0), upper)
+
+    def close(self):
+        self.evaluator.close()
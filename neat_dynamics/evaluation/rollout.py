@@ -0,0 +1,221 @@
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from neat_dynamics.neat.array_genome import ArrayGenome, CompactOrganism, net_mutations
+from neat_dynamics.neat.phenotype import PhenotypeCache
+
+def cartpole_done(states):
+    """Get which CartPole states end the episode, the cart leaving the track or the pole falling past 12 degrees."""
+    return (np.abs(states[:, 0]) > 2.4) | (np.abs(states[:, 2]) > 12 * 2 * np.pi / 360)
+
+def cartpole_return_bound(state, steps_left):
+    """Get an upper bound on the CartPole return still to come, one per step."""
+    return float(steps_left)
+
+def lunar_lander_done(states):
+    """Get which LunarLander states end the episode, the lander flying off either side of the screen.
+
+    Crashes and coming to rest are read from the physics bodies rather than
+    the observation, so imagined episodes that would end that way run on to
+    the horizon.
+    """
+    return np.abs(states[:, 0]) >= 1.0
+
+def lunar_lander_return_bound(state, steps_left):
+    """Get an upper bound on the LunarLander return still to come.
+
+    The shaping rewards sum to the final shaping minus the current one, the
+    final shaping is at most 20 with both legs down, landing adds 100 and
+    engine costs only take away.
+    """
+    shaping = (
+        -100 * np.sqrt(state[0] ** 2 + state[1] ** 2)
+        - 100 * np.sqrt(state[2] ** 2 + state[3] ** 2)
+        - 100 * abs(state[4])
+        + 10 * state[6]
+        + 10 * state[7])
+    return 120.0 - float(shaping)
+
+@dataclass
+class EnvSpec:
+    """How to build a novelty environment and read skill descriptors from it."""
+    env_id: str
+    # Number of leading observation dims in the skill descriptor, None uses the whole final state
+    descriptor_dims: int
+    max_steps: int
+    # Known termination condition on batches of states, used where the real environment is not stepped
+    done_fn: object = None
+    # Upper bound on the return still to come from a state with steps_left steps to go, used to stop rollouts early
+    return_bound: object = None
+
+ENV_SPECS = {
+    "cartpole": EnvSpec("CartPole-v1", None, 500, cartpole_done, cartpole_return_bound),
+    "lunar_lander": EnvSpec("LunarLander-v2", 2, 1000, lunar_lander_done, lunar_lander_return_bound)
+}
+
+@dataclass
+class RolloutResult:
+    fitness: float
+    skill_descriptor: np.ndarray
+    states: np.ndarray
+    actions: np.ndarray
+    rewards: np.ndarray
+    next_states: np.ndarray
+    dones: np.ndarray
+    # Imagined rollouts come from the dynamics model and carry no transitions
+    imagined: bool = False
+    # Episodes a RolloutController cut short and the steps they had left to the limit
+    episodes_stopped: int = 0
+    steps_saved: int = 0
+
+def make_env(spec):
+    import gym
+    return gym.make(spec.env_id)
+
+def env_dims(env):
+    """Get the number of network inputs and outputs for an environment."""
+    return env.observation_space.shape[0], env.action_space.n
+
+def reset_env(env, seed):
+    """Reset an environment under both the old and the new gym API."""
+    try:
+        obs = env.reset(seed=seed)
+    except TypeError:
+        env.seed(seed)
+        obs = env.reset()
+
+    # The new API returns (obs, info)
+    if isinstance(obs, tuple):
+        obs = obs[0]
+    return np.asarray(obs, dtype=np.float32)
+
+def step_env(env, action):
+    """Step an environment under both the old and the new gym API."""
+    step = env.step(action)
+    if len(step) == 5:
+        obs, reward, terminated, truncated, _ = step
+        done = terminated or truncated
+    else:
+        obs, reward, done, _ = step
+
+    return np.asarray(obs, dtype=np.float32), float(reward), bool(done)
+
+def skill_descriptor(spec, final_state):
+    if spec.descriptor_dims is None:
+        return np.asarray(final_state, dtype=np.float64)
+    return np.asarray(final_state[:spec.descriptor_dims], dtype=np.float64)
+
+def genome_of(org, num_inputs, num_outputs):
+    """Get the compact genome to ship for an organism."""
+    if isinstance(org, CompactOrganism):
+        return org.genome
+    return ArrayGenome.from_net(org.net, num_inputs, num_outputs)
+
+class GenomeCache:
+    """LRU cache of the genomes converted from net-backed organisms, keyed by organism id.
+
+    A net converted afresh on every evaluation gets a new structure number
+    every time and never hits the PhenotypeCache. An entry is converted again
+    once the population's Mutator has changed the net since, as counted by
+    net_mutated. CompactOrganisms carry their genome and skip the cache.
+    """
+    def __init__(self, capacity, num_inputs, num_outputs):
+        self.capacity = capacity
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        # Organism id to the mutation count converted at and the genome, least recently used first
+        self.entries = OrderedDict()
+
+    def get(self, org):
+        """Get the genome of an organism."""
+        if isinstance(org, CompactOrganism) or self.capacity <= 0:
+            return genome_of(org, self.num_inputs, self.num_outputs)
+
+        mutations = net_mutations(org.net)
+        entry = self.entries.pop(org.id, None)
+        if entry is None or entry[0] != mutations:
+            entry = (mutations, genome_of(org, self.num_inputs, self.num_outputs))
+
+        self.entries[org.id] = entry
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry[1]
+
+def episode_starts(result):
+    """Get the first state of every episode in a rollout."""
+    if len(result.states) == 0:
+        return result.states
+    return result.states[np.concatenate(([0], np.flatnonzero(result.dones[:-1]) + 1))]
+
+def rollout(env, net, spec, rng, num_episodes, controller=None):
+    """Run episodes with a compiled network, averaging fitness and final-state descriptors."""
+    fitnesses, descriptors = [], []
+    states, actions, rewards, next_states, dones = [], [], [], [], []
+    episodes_stopped, steps_saved = 0, 0
+    for _ in range(num_episodes):
+        net.reset()
+        state = reset_env(env, int(rng.integers(2 ** 31)))
+        monitor = controller.episode() if controller is not None else None
+        total_reward = 0.0
+        for step in range(spec.max_steps):
+            action = int(np.argmax(net.activate(state)))
+            next_state, reward, done = step_env(env, action)
+
+            total_reward += reward
+            if not done and monitor is not None and monitor.stop(step + 1, next_state, total_reward):
+                # Recorded like a time limit truncation, so the next episode's start is still found
+                done = True
+                episodes_stopped += 1
+                steps_saved += spec.max_steps - step - 1
+
+            states.append(state)
+            actions.append(action)
+            rewards.append(reward)
+            next_states.append(next_state)
+            dones.append(done)
+
+            state = next_state
+            if done:
+                break
+
+        fitnesses.append(total_reward)
+        descriptors.append(skill_descriptor(spec, state))
+
+    return RolloutResult(
+        float(np.mean(fitnesses)),
+        np.mean(descriptors, axis=0),
+        np.array(states, dtype=np.float32),
+        np.array(actions, dtype=np.int64),
+        np.array(rewards, dtype=np.float32),
+        np.array(next_states, dtype=np.float32),
+        np.array(dones, dtype=bool),
+        episodes_stopped=episodes_stopped,
+        steps_saved=steps_saved)
+
+class SerialEvaluator:
+    """Evaluates organisms one at a time on a single environment."""
+    def __init__(self, args, spec, controller=None):
+        self.args = args
+        self.spec = spec
+        self.controller = controller
+        self.env = make_env(spec)
+        self.num_inputs, self.num_outputs = env_dims(self.env)
+        self.rng = np.random.default_rng(args.seed)
+        self.phenotypes = PhenotypeCache(args.phenotype_cache_size)
+        self.genomes = GenomeCache(args.phenotype_cache_size, self.num_inputs, self.num_outputs)
+
+    def evaluate(self, orgs):
+        """Roll out every organism, set its avg_fitness and get the rollout results in order."""
+        results = []
+        for org in orgs:
+            net = self.phenotypes.get(self.genomes.get(org))
+            results.append(rollout(self.env, net, self.spec, self.rng, self.args.eval_episodes, self.controller))
+            org.avg_fitness = results[-1].fitness
+
+        if self.controller is not None:
+            self.controller.record(results)
+        return results
+
+    def close(self):
+        self.env.close()
@@ -0,0 +1,96 @@
+import numpy as np
+
+from neat_dynamics.evaluation.rollout import GenomeCache, RolloutResult, env_dims, make_env, reset_env, skill_descriptor, step_env
+from neat_dynamics.neat.phenotype import BatchedNetwork
+
+class VectorizedEvaluator:
+    """Evaluates organisms in lockstep on a vector of environment copies.
+
+    Each step, the actions of every organism come from one forward pass of a
+    BatchedNetwork, then every environment whose episode is still running is
+    stepped. Finished episodes are masked out until the whole batch is done.
+    """
+    def __init__(self, args, spec, controller=None):
+        self.args = args
+        self.spec = spec
+        self.controller = controller
+        self.num_envs = args.num_envs
+        self.envs = [make_env(spec) for _ in range(self.num_envs)]
+        self.num_inputs, self.num_outputs = env_dims(self.envs[0])
+        self.genomes = GenomeCache(args.phenotype_cache_size, self.num_inputs, self.num_outputs)
+        self.rng = np.random.default_rng(args.seed)
+
+    def evaluate(self, orgs):
+        """Roll out every organism, set its avg_fitness and get the rollout results in order."""
+        results = []
+        for start in range(0, len(orgs), self.num_envs):
+            batch_orgs = orgs[start:start + self.num_envs]
+            genomes = [self.genomes.get(org) for org in batch_orgs]
+            results.extend(self.rollout_batch(BatchedNetwork(genomes), self.envs[:len(batch_orgs)]))
+
+        for org, result in zip(orgs, results):
+            org.avg_fitness = result.fitness
+        if self.controller is not None:
+            self.controller.record(results)
+        return results
+
+    def rollout_batch(self, net, envs):
+        """Run num_episodes episodes of every organism in lockstep, one environment per organism."""
+        num_orgs = len(envs)
+        fitnesses = np.zeros((self.args.eval_episodes, num_orgs))
+        descriptors = [[] for _ in range(num_orgs)]
+        transitions = [([], [], [], [], []) for _ in range(num_orgs)]
+        episodes_stopped = np.zeros(num_orgs, dtype=np.int64)
+        steps_saved = np.zeros(num_orgs, dtype=np.int64)
+
+        for episode in range(self.args.eval_episodes):
+            net.reset()
+            states = np.stack([reset_env(env, int(self.rng.integers(2 ** 31))) for env in envs])
+            active = np.ones(num_orgs, dtype=bool)
+            monitors = [self.controller.episode() if self.controller is not None else None for _ in range(num_orgs)]
+            for step in range(self.spec.max_steps):
+                actions = np.argmax(net.activate(states), axis=1)
+                for i in np.flatnonzero(active):
+                    next_state, reward, done = step_env(envs[i], int(actions[i]))
+                    fitnesses[episode, i] += reward
+                    if not done and monitors[i] is not None and monitors[i].stop(step + 1, next_state, fitnesses[episode, i]):
+                        # Recorded like a time limit truncation, so the next episode's start is still found
+                        done = True
+                        episodes_stopped[i] += 1
+                        steps_saved[i] += self.spec.max_steps - step - 1
+
+                    org_states, org_actions, org_rewards, org_next_states, org_dones = transitions[i]
+                    org_states.append(states[i].copy())
+                    org_actions.append(actions[i])
+                    org_rewards.append(reward)
+                    org_next_states.append(next_state)
+                    org_dones.append(done)
+
+                    states[i] = next_state
+                    active[i] = not done
+
+                if not active.any():
+                    break
+
+            for i in range(num_orgs):
+                descriptors[i].append(skill_descriptor(self.spec, states[i]))
+
+        results = []
+        for i in range(num_orgs):
+            org_states, org_actions, org_rewards, org_next_states, org_dones = transitions[i]
+            results.append(RolloutResult(
+                float(fitnesses[:, i].mean()),
+                np.mean(descriptors[i], axis=0),
+                np.array(org_states, dtype=np.float32),
+                np.array(org_actions, dtype=np.int64),
+                np.array(org_rewards, dtype=np.float32),
+                np.array(org_next_states, dtype=np.float32),
+                np.array(org_dones, dtype=bool),
+                episodes_stopped=int(episodes_stopped[i]),
+                steps_saved=int(steps_saved[i])))
+
+        return results
+
+    def close(self):
+        for env in self.envs:
+            env.close()
@@ -0,0 +1,88 @@
+import cProfile, json, os, resource, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+def current_rss():
+    """Get the resident set size of the process in bytes, its high-water mark where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class GenerationMetrics:
+    """Records the wall time of each phase of a generation and the sizes of the population, one JSONL line per generation.
+
+    Phases nest and a phase's time excludes the phases timed inside it, so
+    an evaluation phase wrapped around a whole generation keeps only what
+    evolve and model training do not time themselves. Generations listed in
+    profile_generations run under cProfile, their stats are dumped to
+    profile_dir for pstats or snakeviz.
+    """
+    def __init__(self, metrics_file=None, profile_generations=(), profile_dir=None):
+        self.profile_generations = set(profile_generations)
+        self.profile_dir = profile_dir
+        self._out = None
+        if metrics_file is not None:
+            os.makedirs(os.path.dirname(metrics_file) or ".", exist_ok=True)
+            self._out = open(metrics_file, "a")
+        self._profiler = None
+        # Time spent in phases nested inside each open phase
+        self._nested = []
+        # Phases timed outside any generation still have a record to go to, it is never profiled
+        self.reset_record(0)
+
+    def reset_record(self, generation):
+        self.record = {"generation": generation}
+        self.phases = defaultdict(float)
+        self._start = time.perf_counter()
+
+    def start_generation(self, generation):
+        """Start a new record, profiling the generation if it is listed and dropping any unfinished profile."""
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler = None
+        self.reset_record(generation)
+        if generation in self.profile_generations:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """Add the wall time of the block, less the phases timed inside it, to phase name."""
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] += elapsed - self._nested.pop()
+            if len(self._nested) > 0:
+                self._nested[-1] += elapsed
+
+    def set(self, **values):
+        self.record.update(values)
+
+    def end_generation(self):
+        """Finish the generation's record, write it out and get it."""
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(self.profile_dir, "generation_%06d.prof" % self.record["generation"]))
+            self._profiler = None
+
+        self.record["seconds"] = time.perf_counter() - self._start
+        self.record["phases"] = dict(self.phases)
+        self.record["rss_bytes"] = current_rss()
+        self.write(self.record)
+        return self.record
+
+    def write(self, record):
+        """Append a finished record to the metrics file, also ones finished by a recorder in another process."""
+        if self._out is not None:
+            self._out.write(json.dumps(record) + "\n")
+            self._out.flush()
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
@@ -0,0 +1,310 @@
+import itertools, random
+import numpy as np
+
+# One row per link gene, kept sorted by innovation id
+LINK_DTYPE = np.dtype([
+    ("gid", np.int64),
+    ("src", np.int32),
+    ("dst", np.int32),
+    ("weight", np.float64),
+    ("enabled", np.bool_)])
+
+# One row per node gene, kept sorted by node id
+NODE_DTYPE = np.dtype([
+    ("id", np.int32),
+    ("bias", np.float64)])
+
+# Where each genome sits in the concatenated link and node arrays of a packed batch
+GENOME_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("link_start", np.int64),
+    ("link_count", np.int64),
+    ("node_start", np.int64),
+    ("node_count", np.int64),
+    ("num_inputs", np.int32),
+    ("num_outputs", np.int32)])
+
+# Number of random node pairs tried before giving up on adding a link
+ADD_LINK_TRIES = 20
+
+# Source of genome structure and version numbers, every number is handed out once per process
+_genome_versions = itertools.count()
+
+class InnovationTracker:
+    """Hands out node and gene ids, giving the same structural mutation the same ids within a generation."""
+    def __init__(self, next_node_id, next_gene_id):
+        self.next_node_id = next_node_id
+        self.next_gene_id = next_gene_id
+        self._innovations = {}
+
+    def split(self, gene_id):
+        """Get the new node id and the ids of the two links that replace a split link."""
+        key = ("node", gene_id)
+        if key not in self._innovations:
+            self._innovations[key] = (self.next_node_id, self.next_gene_id, self.next_gene_id + 1)
+            self.next_node_id += 1
+            self.next_gene_id += 2
+
+        return self._innovations[key]
+
+    def link(self, src, dst):
+        key = ("link", src, dst)
+        if key not in self._innovations:
+            self._innovations[key] = self.next_gene_id
+            self.next_gene_id += 1
+
+        return self._innovations[key]
+
+    def new_generation(self):
+        self._innovations = {}
+
+def net_mutated(net):
+    """Count a change to a network object graph, so genomes converted from it before are known to be stale."""
+    net.mutations = getattr(net, "mutations", 0) + 1
+
+def net_mutations(net):
+    """Get the number of changes counted on a network object graph."""
+    return getattr(net, "mutations", 0)
+
+class ArrayGenome:
+    """Struct-of-arrays genome with link and node genes in typed NumPy arrays.
+
+    Node ids [0, num_inputs) are the inputs and the next num_outputs ids are
+    the outputs, matching the order the base network creates its nodes in.
+    A genome draws a new structure number when it is created or gains a node
+    or link, and a new version on any change, so compiled phenotypes can be
+    cached against them.
+    """
+    __slots__ = ("links", "nodes", "num_inputs", "num_outputs", "structure", "version")
+
+    def __init__(self, links, nodes, num_inputs, num_outputs):
+        self.links = links
+        self.nodes = nodes
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.structure_changed()
+
+    @classmethod
+    def from_net(cls, net, num_inputs, num_outputs):
+        """Pack the genes of a network object graph."""
+        links = np.array(
+            [(gid, link.in_node.gid, link.out_node.gid, link.trait.weight, link.enabled) for gid, link in net.links.items()],
+            dtype=LINK_DTYPE)
+        net_nodes = net.nodes.values() if isinstance(net.nodes, dict) else net.nodes
+        nodes = np.array([(node.gid, node.bias) for node in net_nodes], dtype=NODE_DTYPE)
+
+        links.sort(order="gid")
+        nodes.sort(order="id")
+        return cls(links, nodes, num_inputs, num_outputs)
+
+    @classmethod
+    def initial(cls, num_inputs, num_outputs):
+        """Create a genome linking every input to every output with zero weights."""
+        nodes = np.zeros(num_inputs + num_outputs, dtype=NODE_DTYPE)
+        nodes["id"] = np.arange(num_inputs + num_outputs)
+        links = np.zeros(num_inputs * num_outputs, dtype=LINK_DTYPE)
+        links["gid"] = np.arange(num_inputs * num_outputs)
+        links["src"] = np.repeat(np.arange(num_inputs), num_outputs)
+        links["dst"] = num_inputs + np.tile(np.arange(num_outputs), num_inputs)
+        links["enabled"] = True
+        return cls(links, nodes, num_inputs, num_outputs)
+
+    def copy(self):
+        return ArrayGenome(self.links.copy(), self.nodes.copy(), self.num_inputs, self.num_outputs)
+
+    def crossover(self, other, fitness, other_fitness, avg_trait_rate, enable_rate):
+        """Create a child with the genes of the fitter parent and matching genes drawn from both."""
+        return crossover_batch([self], [other], [fitness], [other_fitness], avg_trait_rate, enable_rate)[0]
+
+    def mutate_link_weights(self, args, rand_rate):
+        """Reinitialize each weight with probability rand_rate and perturb the rest."""
+        mutate_link_weights_batch([self], args, rand_rate)
+
+    def mutate_add_node(self, innovations):
+        """Split a random enabled link with a new node."""
+        enabled_rows = np.flatnonzero(self.links["enabled"])
+        if len(enabled_rows) == 0:
+            return
+
+        split = self.links[random.choice(enabled_rows)]
+        node_id, in_gid, out_gid = innovations.split(int(split["gid"]))
+        if node_id in self.nodes["id"]:
+            # This genome already split the link before it was re-enabled
+            return
+
+        self.links["enabled"][self.links["gid"] == split["gid"]] = False
+        self._insert_links(np.array([
+            (in_gid, split["src"], node_id, 1.0, True),
+            (out_gid, node_id, split["dst"], split["weight"], True)], dtype=LINK_DTYPE))
+        self.nodes = np.insert(
+            self.nodes, np.searchsorted(self.nodes["id"], node_id), np.array((node_id, 0.0), dtype=NODE_DTYPE))
+        self.structure_changed()
+
+    def mutate_add_link(self, args, innovations):
+        """Connect a random pair of unconnected nodes, only allowing a recurrent link at mutate_add_recur_rate."""
+        connected = set(zip(self.links["src"].tolist(), self.links["dst"].tolist()))
+        node_ids = self.nodes["id"].tolist()
+        # Inputs never receive links
+        dst_ids = node_ids[self.num_inputs:]
+        for _ in range(ADD_LINK_TRIES):
+            src, dst = random.choice(node_ids), random.choice(dst_ids)
+            if (src, dst) in connected:
+                continue
+
+            if self.reaches(dst, src) and random.random() > args.mutate_add_recur_rate:
+                continue
+
+            weight = random.gauss(args.init_weight_mean, args.init_weight_std)
+            self._insert_links(np.array([(innovations.link(src, dst), src, dst, weight, True)], dtype=LINK_DTYPE))
+            self.structure_changed()
+            return
+
+    def reaches(self, src, dst):
+        """Get whether a path of links leads from src to dst."""
+        children = {}
+        for link_src, link_dst in zip(self.links["src"].tolist(), self.links["dst"].tolist()):
+            children.setdefault(link_src, []).append(link_dst)
+
+        stack, seen = [src], {src}
+        while len(stack) > 0:
+            node_id = stack.pop()
+            if node_id == dst:
+                return True
+            for child in children.get(node_id, []):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+
+        return False
+
+    def structure_changed(self):
+        self.structure = self.version = next(_genome_versions)
+
+    def weights_changed(self):
+        self.version = next(_genome_versions)
+
+    def _insert_links(self, new_links):
+        new_links = new_links[~np.isin(new_links["gid"], self.links["gid"])]
+        self.links = np.concatenate([self.links, new_links])
+        self.links.sort(order="gid", kind="stable")
+
+    @property
+    def nbytes(self):
+        return self.links.nbytes + self.nodes.nbytes
+
+def pack_genomes(ids, genomes):
+    """Pack genomes into a table and two concatenated arrays, ready to save or send."""
+    table = np.zeros(len(genomes), dtype=GENOME_DTYPE)
+    table["id"] = ids
+    table["link_count"] = [len(genome.links) for genome in genomes]
+    table["node_count"] = [len(genome.nodes) for genome in genomes]
+    table["link_start"] = np.cumsum(table["link_count"]) - table["link_count"]
+    table["node_start"] = np.cumsum(table["node_count"]) - table["node_count"]
+    table["num_inputs"] = [genome.num_inputs for genome in genomes]
+    table["num_outputs"] = [genome.num_outputs for genome in genomes]
+
+    links = np.concatenate([genome.links for genome in genomes]) if len(genomes) > 0 else np.empty(0, dtype=LINK_DTYPE)
+    nodes = np.concatenate([genome.nodes for genome in genomes]) if len(genomes) > 0 else np.empty(0, dtype=NODE_DTYPE)
+    return table, links, nodes
+
+def unpack_genomes(table, links, nodes):
+    """Get the genomes of a packed table keyed by id, copied out of the (possibly memory-mapped) arrays."""
+    genomes = {}
+    for row in table:
+        genomes[int(row["id"])] = ArrayGenome(
+            np.array(links[row["link_start"]:row["link_start"] + row["link_count"]]),
+            np.array(nodes[row["node_start"]:row["node_start"] + row["node_count"]]),
+            int(row["num_inputs"]),
+            int(row["num_outputs"]))
+
+    return genomes
+
+def crossover_batch(parents_1, parents_2, fitnesses_1, fitnesses_2, avg_trait_rate, enable_rate):
+    """Cross many parent pairs at once.
+
+    Children take the genes of their fitter parent. Matching genes are averaged
+    at avg_trait_rate or else taken from either parent at random.
+    """
+    first_fitter = np.asarray(fitnesses_1) >= np.asarray(fitnesses_2)
+    fitters = [p_1 if fitter else p_2 for p_1, p_2, fitter in zip(parents_1, parents_2, first_fitter)]
+    weakers = [p_2 if fitter else p_1 for p_1, p_2, fitter in zip(parents_1, parents_2, first_fitter)]
+
+    links, link_counts = _concat_genes(fitters, "links")
+    weak_links, weak_counts = _concat_genes(weakers, "links")
+    fit_rows, weak_rows = _match_batch(links["gid"], link_counts, weak_links["gid"], weak_counts)
+    links["weight"][fit_rows] = _mix_batch(links["weight"][fit_rows], weak_links["weight"][weak_rows], avg_trait_rate)
+
+    # Genes disabled in either parent stay disabled unless they are re-enabled
+    disabled = ~(links["enabled"][fit_rows] & weak_links["enabled"][weak_rows])
+    links["enabled"][fit_rows] = ~disabled | (np.random.random(len(fit_rows)) < enable_rate)
+
+    nodes, node_counts = _concat_genes(fitters, "nodes")
+    weak_nodes, weak_counts = _concat_genes(weakers, "nodes")
+    fit_rows, weak_rows = _match_batch(nodes["id"], node_counts, weak_nodes["id"], weak_counts)
+    nodes["bias"][fit_rows] = _mix_batch(nodes["bias"][fit_rows], weak_nodes["bias"][weak_rows], avg_trait_rate)
+
+    # Copy each child out so no child keeps the whole batch buffer alive
+    link_splits = np.split(links, np.cumsum(link_counts)[:-1])
+    node_splits = np.split(nodes, np.cumsum(node_counts)[:-1])
+    return [
+        ArrayGenome(child_links.copy(), child_nodes.copy(), fitter.num_inputs, fitter.num_outputs)
+        for child_links, child_nodes, fitter in zip(link_splits, node_splits, fitters)]
+
+def mutate_link_weights_batch(genomes, args, rand_rate):
+    """Reinitialize or perturb the weights of many genomes as one array operation."""
+    if len(genomes) == 0:
+        return
+
+    weights, counts = _concat_genes(genomes, "links")
+    weights = weights["weight"]
+    reinit = np.random.random(len(weights)) < rand_rate
+    weights[reinit] = np.random.normal(args.init_weight_mean, args.init_weight_std, reinit.sum())
+    weights[~reinit] += np.random.normal(0.0, args.mutate_weight_power, len(weights) - reinit.sum())
+    np.clip(weights, args.weight_min, args.weight_max, out=weights)
+
+    for genome, genome_weights in zip(genomes, np.split(weights, np.cumsum(counts)[:-1])):
+        genome.links["weight"] = genome_weights
+        genome.weights_changed()
+
+def _concat_genes(genomes, field):
+    genes = [getattr(genome, field) for genome in genomes]
+    return np.concatenate(genes), np.array([len(cur_genes) for cur_genes in genes], dtype=np.int64)
+
+def _match_batch(ids, counts, other_ids, other_counts):
+    """Get the rows of the ids shared by each pair of genomes in two concatenated id arrays."""
+    if len(other_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Offset every genome's ids past the previous genome's so both arrays stay sorted
+    stride = int(max(ids.max(initial=0), other_ids.max(initial=0))) + 1
+    keys = np.repeat(np.arange(len(counts), dtype=np.int64), counts) * stride + ids
+    other_keys = np.repeat(np.arange(len(other_counts), dtype=np.int64), other_counts) * stride + other_ids
+
+    other_rows = np.minimum(np.searchsorted(other_keys, keys), len(other_keys) - 1)
+    matched = other_keys[other_rows] == keys
+    return np.flatnonzero(matched), other_rows[matched]
+
+def _mix_batch(values, other_values, avg_trait_rate):
+    """Average matching genes or pick either parent's value at random."""
+    average = np.random.random(len(values)) < avg_trait_rate
+    take_other = np.random.random(len(values)) < 0.5
+    return np.where(average, (values + other_values) / 2, np.where(take_other, other_values, values))
+
+class CompactOrganism:
+    """Organism backed by an ArrayGenome instead of a network object graph."""
+    __slots__ = ("id", "genome", "generation", "age", "avg_fitness", "adj_fitness")
+
+    def __init__(self, genome, gen=0, id=0):
+        self.id = id
+        self.genome = genome
+        self.generation = gen
+        self.age = 0
+        self.avg_fitness = 0.0
+        self.adj_fitness = 0.0
+
+    def copy(self, id):
+        return CompactOrganism(self.genome.copy(), gen=self.generation, id=id)
+
+    def reset(self):
+        # Compact organisms carry no activation state to clear
+        pass
@@ -0,0 +1,269 @@
+import json, os
+import numpy as np
+
+from neat.species import Species
+from neat.stagnation import Stagnation
+from neat_dynamics.neat.array_genome import CompactOrganism, pack_genomes, unpack_genomes
+from neat_dynamics.novelty.dynamic_qd import ArchivedOrganism, RepoOrgansim
+
+REPLAY_FIELDS = ("states", "actions", "rewards", "next_states", "dones")
+
+# Genome segments are compacted once they hold this many times the live genomes
+COMPACT_FACTOR = 4
+
+class Checkpointer:
+    """Incremental binary checkpoints of a CompactPopulation, its archive and the replay memory.
+
+    A checkpoint directory holds append-only segments plus a small manifest:
+    genome segments with the packed link and node arrays of organisms not
+    saved before, archive segments with the descriptor, fitness and
+    generation of members that are new or whose fitness changed since the
+    last save, replay segments as one .npy file per field with the
+    transitions added since the last save, and a state file with the small,
+    changing parts (fitness, species, archive order and novelty, imagination
+    start states).
+    The manifest is replaced atomically last, so a crash mid-save leaves the
+    previous checkpoint intact. Replay segments are memory-mapped on load.
+    """
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest = {
+            "seq": 0,
+            "genome_segments": [],
+            "archive_segments": [],
+            "replay_segments": [],
+            "replay_num_added": 0,
+            "state": None}
+        # Ids of the genomes stored in the segments
+        self.saved_ids = set()
+        # Fitness and descriptor each archive member was last stored with, keyed by id
+        self.saved_archive = {}
+        # Files the next manifest no longer references, deleted once it is written
+        self.stale_files = []
+
+    def path(self, name):
+        return os.path.join(self.checkpoint_dir, name)
+
+    def exists(self):
+        return os.path.exists(self.path("manifest.json"))
+
+    def save(self, population, imagination=None):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.manifest["seq"] += 1
+        orgs = self.live_orgs(population)
+
+        if len(self.saved_ids) > COMPACT_FACTOR * max(len(orgs), 1):
+            self.compact_genomes(orgs)
+        else:
+            self.save_genomes([org for org in orgs if org.id not in self.saved_ids])
+        self.save_archive(population.dynamic_archive)
+
+        if imagination is not None:
+            self.save_replay(imagination.ensemble.replay_memory)
+
+        old_state = self.manifest["state"]
+        self.manifest["state"] = "state_%06d.npz" % self.manifest["seq"]
+        self.save_state(self.path(self.manifest["state"]), population, orgs, imagination)
+        self.manifest["generation"] = population.generation
+        self.manifest["cur_id"] = population.cur_id
+        self.manifest["innovations"] = [population.innovations.next_node_id, population.innovations.next_gene_id]
+
+        tmp_path = self.path("manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.path("manifest.json"))
+        if old_state is not None:
+            self.stale_files.append(old_state)
+        for name in self.stale_files:
+            os.remove(self.path(name))
+        self.stale_files = []
+
+    def live_orgs(self, population):
+        """Get the organisms holding a genome, the population and the resident archive members."""
+        orgs = {org.id: org for org in population.orgs}
+        for org in population.dynamic_archive.get_orgs():
+            orgs.setdefault(org.id, org)
+        return list(orgs.values())
+
+    def save_genomes(self, orgs):
+        """Write the genomes of the organisms as one segment."""
+        if len(orgs) == 0:
+            return
+
+        name = "genomes_%06d" % self.manifest["seq"]
+        table, links, nodes = pack_genomes([org.id for org in orgs], [org.genome for org in orgs])
+        np.save(self.path(name + "_table.npy"), table)
+        np.save(self.path(name + "_links.npy"), links)
+        np.save(self.path(name + "_nodes.npy"), nodes)
+        self.manifest["genome_segments"].append(name)
+        self.saved_ids.update(int(org_id) for org_id in table["id"])
+
+    def compact_genomes(self, orgs):
+        """Rewrite the live genomes as a single segment and drop the old segments."""
+        old_segments = self.manifest["genome_segments"]
+        self.manifest["genome_segments"] = []
+        self.saved_ids = set()
+        self.save_genomes(orgs)
+        for name in old_segments:
+            for suffix in ("_table.npy", "_links.npy", "_nodes.npy"):
+                self.stale_files.append(name + suffix)
+
+    def save_archive(self, archive):
+        """Write the members that are new or changed as one segment, compacting once most rows are stale.
+
+        A member changes when its fitness is updated, or when it left the
+        archive and came back with another descriptor.
+        """
+        members = list(archive.novel_archive.values())
+        num_rows = sum(count for _, count in self.manifest["archive_segments"])
+        if num_rows > COMPACT_FACTOR * max(len(members), 1):
+            for name, _ in self.manifest["archive_segments"]:
+                self.stale_files.append(name + ".npy")
+            self.manifest["archive_segments"] = []
+            self.saved_archive = {}
+
+        # Forget members that have left the archive
+        self.saved_archive = {
+            member.org.id: self.saved_archive[member.org.id] for member in members if member.org.id in self.saved_archive}
+        changed = [member for member in members if not self.is_saved(member)]
+        if len(changed) == 0:
+            return
+
+        name = "archive_%06d" % self.manifest["seq"]
+        rows = np.zeros(len(changed), dtype=[
+            ("id", np.int64),
+            ("avg_fitness", np.float64),
+            ("generation", np.int64),
+            ("descriptor", np.float64, (len(changed[0].skill_descriptor),))])
+        rows["id"] = [member.org.id for member in changed]
+        rows["avg_fitness"] = [member.org.avg_fitness for member in changed]
+        rows["generation"] = [member.org.generation for member in changed]
+        rows["descriptor"] = [member.skill_descriptor for member in changed]
+        np.save(self.path(name + ".npy"), rows)
+        self.manifest["archive_segments"].append([name, len(changed)])
+        for row in rows:
+            self.saved_archive[int(row["id"])] = (float(row["avg_fitness"]), row["descriptor"])
+
+    def is_saved(self, member):
+        saved = self.saved_archive.get(member.org.id)
+        return saved is not None and saved[0] == member.org.avg_fitness and np.array_equal(saved[1], member.skill_descriptor)
+
+    def save_replay(self, replay_memory):
+        """Write the transitions added since the last save and drop segments the memory has overwritten."""
+        num_new = min(replay_memory.num_added - self.manifest["replay_num_added"], replay_memory.current_capacity())
+        if num_new > 0:
+            name = "replay_%06d" % self.manifest["seq"]
+            for field, values in zip(REPLAY_FIELDS, replay_memory.latest(num_new)):
+                np.save(self.path("%s_%s.npy" % (name, field)), values)
+            self.manifest["replay_segments"].append([name, num_new])
+            self.manifest["replay_num_added"] = replay_memory.num_added
+
+        # Keep the newest segments that still cover the memory
+        capacity = replay_memory._args.memory_capacity
+        kept, num_kept = [], 0
+        for name, count in reversed(self.manifest["replay_segments"]):
+            if num_kept >= capacity:
+                for field in REPLAY_FIELDS:
+                    self.stale_files.append("%s_%s.npy" % (name, field))
+            else:
+                kept.append([name, count])
+                num_kept += count
+        self.manifest["replay_segments"] = kept[::-1]
+
+    def save_state(self, path, population, orgs, imagination):
+        archive = population.dynamic_archive
+        live_ids = set(org.id for org in orgs)
+        species_orgs = [[org.id for org in species.orgs if org.id in live_ids] for species in population.species_list]
+        np.savez(
+            path,
+            org_ids=np.array([org.id for org in orgs], dtype=np.int64),
+            org_generations=np.array([org.generation for org in orgs], dtype=np.int64),
+            org_ages=np.array([org.age for org in orgs], dtype=np.int64),
+            org_avg_fitness=np.array([org.avg_fitness for org in orgs], dtype=np.float64),
+            org_adj_fitness=np.array([org.adj_fitness for org in orgs], dtype=np.float64),
+            population_ids=np.array([org.id for org in population.orgs], dtype=np.int64),
+            species_sizes=np.array([len(ids) for ids in species_orgs], dtype=np.int64),
+            species_org_ids=np.array([org_id for ids in species_orgs for org_id in ids], dtype=np.int64),
+            archive_ids=np.array(list(archive.novel_archive), dtype=np.int64),
+            archive_novelty=np.array([member.novelty_score for member in archive.novel_archive.values()], dtype=np.float64),
+            archive_resident_ids=np.array(list(archive._resident), dtype=np.int64),
+            start_states=imagination.start_states if imagination is not None else np.empty((0, 0), dtype=np.float32))
+
+    def load(self, population, imagination=None):
+        """Restore the population, archive and replay memory from the checkpoint directory."""
+        with open(self.path("manifest.json")) as f:
+            self.manifest = json.load(f)
+        state = np.load(self.path(self.manifest["state"]))
+
+        # Organisms with their genomes and latest statistics
+        genomes = self.load_genomes(set(state["org_ids"].tolist()))
+        orgs = {}
+        for i, org_id in enumerate(state["org_ids"].tolist()):
+            org = CompactOrganism(genomes[org_id], gen=int(state["org_generations"][i]), id=org_id)
+            org.age = int(state["org_ages"][i])
+            org.avg_fitness = float(state["org_avg_fitness"][i])
+            org.adj_fitness = float(state["org_adj_fitness"][i])
+            orgs[org_id] = org
+
+        population.orgs = [orgs[org_id] for org_id in state["population_ids"].tolist()]
+        population.species_list = []
+        # Species tracked since setup would otherwise stay in stagnation
+        population.stagnation = Stagnation(population.args)
+        species_org_ids = np.split(state["species_org_ids"], np.cumsum(state["species_sizes"])[:-1])
+        for org_ids in species_org_ids[:len(state["species_sizes"])]:
+            species = Species(population.args, len(population.species_list))
+            population.add_species(species)
+            for org_id in org_ids.tolist():
+                species.add(orgs[org_id])
+
+        # Members whose organism was released come back as stand-ins
+        rows = self.load_archive()
+        repo_orgs = []
+        for i, org_id in enumerate(state["archive_ids"].tolist()):
+            row = rows[org_id]
+            org = orgs[org_id] if org_id in orgs else ArchivedOrganism(
+                org_id, float(row["avg_fitness"]), int(row["generation"]))
+            repo_orgs.append(RepoOrgansim(org, float(state["archive_novelty"][i]), np.array(row["descriptor"])))
+        population.dynamic_archive.restore(repo_orgs, state["archive_resident_ids"].tolist())
+
+        population.generation = self.manifest["generation"]
+        population.cur_id = self.manifest["cur_id"]
+        population.innovations.next_node_id, population.innovations.next_gene_id = self.manifest["innovations"]
+
+        if imagination is not None:
+            self.load_replay(imagination.ensemble.replay_memory)
+            if state["start_states"].size > 0:
+                imagination.start_states = state["start_states"]
+
+    def load_genomes(self, org_ids):
+        """Get the stored genomes of the organisms, keyed by id."""
+        genomes = {}
+        for name in self.manifest["genome_segments"]:
+            table = np.load(self.path(name + "_table.npy"))
+            self.saved_ids.update(table["id"].tolist())
+            wanted = table[np.isin(table["id"], list(org_ids))]
+            if len(wanted) == 0:
+                continue
+
+            genomes.update(unpack_genomes(
+                wanted,
+                np.load(self.path(name + "_links.npy"), mmap_mode="r"),
+                np.load(self.path(name + "_nodes.npy"), mmap_mode="r")))
+
+        return genomes
+
+    def load_archive(self):
+        """Get the latest stored row of every archive member, keyed by id."""
+        rows = {}
+        for name, _ in self.manifest["archive_segments"]:
+            for row in np.load(self.path(name + ".npy")):
+                rows[int(row["id"])] = row
+        self.saved_archive = {org_id: (float(row["avg_fitness"]), row["descriptor"]) for org_id, row in rows.items()}
+        return rows
+
+    def load_replay(self, replay_memory):
+        for name, _ in self.manifest["replay_segments"]:
+            replay_memory.add_transitions(*[
+                np.array(np.load(self.path("%s_%s.npy" % (name, field)), mmap_mode="r")) for field in REPLAY_FIELDS])
+        # Count from the saved total so the next save only writes what is new
+        replay_memory.num_added = self.manifest["replay_num_added"]
@@ -0,0 +1,114 @@
+import random
+import numpy as np
+
+from neat_dynamics.neat.array_genome import ArrayGenome, CompactOrganism, InnovationTracker, crossover_batch, mutate_link_weights_batch
+from neat_dynamics.neat.dynamic_population import DynamicPopulation
+
+class CompactPopulation(DynamicPopulation):
+    """DynamicPopulation whose organisms carry ArrayGenomes instead of network object graphs.
+
+    Spawning copies genome buffers, crossover is a merge of innovation-sorted
+    arrays and mutation works on the weight array in place. A generation's
+    children are crossed and weight-mutated together as concatenated arrays,
+    so reproduction scales with the total gene count.
+    """
+    def __init__(self, args, config, num_inputs, num_outputs):
+        super().__init__(args, config)
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        self.innovations = None
+
+    def setup(self, net):
+        self.setup_genome(ArrayGenome.from_net(net, self.num_inputs, self.num_outputs))
+
+    def setup_genome(self, base_genome):
+        self.base_org = CompactOrganism(base_genome)
+        self.innovations = InnovationTracker(
+            int(base_genome.nodes["id"].max()) + 1,
+            int(base_genome.links["gid"].max()) + 1 if len(base_genome.links) > 0 else 0)
+        self.orgs = self.spawn(self.base_org, self.args.init_pop_size)
+        self.speciate()
+
+    def spawn(self, base_org, pop_size):
+        """Spawn the initial population."""
+        orgs = []
+        for i in range(pop_size):
+            orgs.append(base_org.copy(self.cur_id)) # Create a copy
+            self.cur_id += 1
+
+        # Randomize the link weights
+        mutate_link_weights_batch([org.genome for org in orgs], self.args, 1.0)
+        return orgs
+
+    def evolve(self, skill_descriptors: list):
+        # Structural mutations only share ids within a generation
+        self.innovations.new_generation()
+        super().evolve(skill_descriptors)
+
+    def breed(self, parents_1, parents_2):
+        """Create a mutated child for every pair of parents."""
+        if len(parents_1) == 0:
+            return []
+
+        with self.metrics.phase("crossover"):
+            child_genomes = crossover_batch(
+                [parent.genome for parent in parents_1],
+                [parent.genome for parent in parents_2],
+                [parent.avg_fitness for parent in parents_1],
+                [parent.avg_fitness for parent in parents_2],
+                self.args.reproduce_avg_trait_rate,
+                self.args.mutate_enable_gene)
+
+        with self.metrics.phase("mutation"):
+            # Structural mutations only touch the children drawn for them
+            num_children = len(child_genomes)
+            for i in np.flatnonzero(np.random.random(num_children) <= self.args.mutate_add_node_rate):
+                child_genomes[i].mutate_add_node(self.innovations)
+            for i in np.flatnonzero(np.random.random(num_children) <= self.args.mutate_add_link_rate):
+                child_genomes[i].mutate_add_link(self.args, self.innovations)
+
+            weight_mutated = np.flatnonzero(np.random.random(num_children) <= self.args.mutate_link_weight_rate)
+            mutate_link_weights_batch(
+                [child_genomes[i] for i in weight_mutated], self.args, self.args.mutate_link_weight_rand_rate)
+
+        created_orgs = []
+        for child_genome, parent_1, parent_2 in zip(child_genomes, parents_1, parents_2):
+            created_orgs.append(CompactOrganism(child_genome, gen=max(parent_1.generation, parent_2.generation) + 1, id=self.cur_id))
+            self.cur_id += 1
+
+        return created_orgs
+
+    def reproduce(self, parent_1, parent_2):
+        """Create a mutated child of two parents."""
+        with self.metrics.phase("crossover"):
+            child_genome = parent_1.genome.crossover(
+                parent_2.genome,
+                parent_1.avg_fitness,
+                parent_2.avg_fitness,
+                self.args.reproduce_avg_trait_rate,
+                self.args.mutate_enable_gene)
+
+        with self.metrics.phase("mutation"):
+            self.mutate_child(child_genome)
+        created_org = CompactOrganism(child_genome, gen=max(parent_1.generation, parent_2.generation) + 1, id=self.cur_id)
+
+        # Increment the current organism ID
+        self.cur_id += 1
+        return created_org
+
+    def genome(self, org):
+        return org.genome
+
+    def speciate_fn(self, genome_1, genome_2):
+        """Compare two genomes to determine if they should form a new species."""
+        return self.compatibility.distances([genome_1], [genome_2])[0, 0]
+
+    def mutate_child(self, child_genome):
+        if random.random() <= self.args.mutate_add_node_rate:
+            child_genome.mutate_add_node(self.innovations)
+
+        if random.random() <= self.args.mutate_add_link_rate:
+            child_genome.mutate_add_link(self.args, self.innovations)
+
+        if random.random() <= self.args.mutate_link_weight_rate:
+            child_genome.mutate_link_weights(self.args, self.args.mutate_link_weight_rand_rate)
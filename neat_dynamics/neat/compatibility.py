@@ -0,0 +1,68 @@
+import numpy as np
+from neat_dynamics.neat.array_genome import ArrayGenome
+
+class CompatibilityEngine:
+    """Computes speciate_fn distances between many genomes at once.
+
+    Genomes are encoded sparsely, as one entry per gene holding its genome,
+    its column over the union of innovation ids and its weight, so memory
+    grows with the total gene count rather than genomes times distinct genes.
+    Each representative is spread into a dense presence and weight vector
+    over the columns, gathering those at every entry gives the shared genes
+    and their weight differences, summed per genome with bincount. Traits are
+    compared by their weight, as Trait.distance does for link genes. Both
+    networks and ArrayGenomes can be compared.
+    """
+    def __init__(self, args):
+        self.args = args
+
+    def encode(self, nets):
+        """Get the gene entries of the networks, their genome rows, columns and weights, the genes per network and the number of columns."""
+        gene_ids, weights, counts = [], [], []
+        for net in nets:
+            if isinstance(net, ArrayGenome):
+                gene_ids.append(net.links["gid"])
+                weights.append(net.links["weight"])
+            else:
+                gene_ids.append(np.fromiter(net.links.keys(), dtype=np.int64, count=len(net.links)))
+                weights.append(np.fromiter(
+                    (link.trait.weight for link in net.links.values()), dtype=np.float64, count=len(net.links)))
+            counts.append(len(gene_ids[-1]))
+
+        gene_ids = np.concatenate(gene_ids) if len(nets) > 0 else np.empty(0, dtype=np.int64)
+        weights = np.concatenate(weights) if len(nets) > 0 else np.empty(0)
+        # Column of every gene in the innovation-id order shared by all rows
+        _, cols = np.unique(gene_ids, return_inverse=True)
+        counts = np.array(counts, dtype=np.int64)
+        rows = np.repeat(np.arange(len(nets)), counts)
+        num_genes = int(cols.max()) + 1 if len(cols) > 0 else 0
+        return rows, cols.reshape(-1), weights, counts, num_genes
+
+    def distances(self, nets, rep_nets):
+        """Get the speciate_fn distance between every network and every representative network."""
+        rows, cols, weights, counts, num_genes = self.encode(list(nets) + list(rep_nets))
+        num_nets = len(nets)
+        # Entries are grouped by network, the organisms' come first
+        ends = np.cumsum(counts)
+        split = int(ends[num_nets - 1]) if num_nets > 0 else 0
+        org_rows, org_cols, org_weights = rows[:split], cols[:split], weights[:split]
+
+        num_shared = np.zeros((num_nets, len(rep_nets)))
+        trait_diff = np.zeros((num_nets, len(rep_nets)))
+        rep_present = np.zeros(num_genes, dtype=bool)
+        rep_weights = np.zeros(num_genes)
+        for j in range(len(rep_nets)):
+            end = ends[num_nets + j]
+            rep_cols = cols[end - counts[num_nets + j]:end]
+            rep_present[rep_cols] = True
+            rep_weights[rep_cols] = weights[end - counts[num_nets + j]:end]
+
+            shared = rep_present[org_cols]
+            shared_rows = org_rows[shared]
+            num_shared[:, j] = np.bincount(shared_rows, minlength=num_nets)
+            trait_diff[:, j] = np.bincount(
+                shared_rows, weights=np.abs(org_weights[shared] - rep_weights[org_cols[shared]]), minlength=num_nets)
+            rep_present[rep_cols] = False
+
+        num_disjoint = counts[:num_nets, None] + counts[None, num_nets:] - 2 * num_shared
+        return self.args.speciate_disjoint_factor * num_disjoint + self.args.speciate_weight_factor * (trait_diff / np.maximum(num_shared, 1))
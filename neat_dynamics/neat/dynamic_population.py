@@ -1,4 +1,4 @@
-import math, os, random
+import copy, math, os, random
 import numpy as np
 
 from neat.invocation_counter import InvocationCounter
@@ -7,22 +7,33 @@ from neat.species import Species
 from neat.organism import Organism
 from neat.reproduction import Reproduction
 from neat.stagnation import Stagnation
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+from neat_dynamics.neat.array_genome import net_mutated
+from neat_dynamics.neat.compatibility import CompatibilityEngine
+from neat_dynamics.neat.population_memory import PopulationMemory
 from neat_dynamics.novelty.dynamic_qd import DynamicArchive
 
-class DynamicPopulation:
+class DynamicPopulation(PopulationMemory):
     """Maintains the population of organisms."""
     def __init__(self, args, config):
         self.args = args
         self.config = config
         self.inv_counter = InvocationCounter()
         self.mutator = Mutator(self.args, self.inv_counter)
+        # Spawning randomizes every link weight, give it its own args instead of flipping the shared ones
+        spawn_args = copy.copy(self.args)
+        spawn_args.mutate_link_weight_rand_rate = 1.0
+        self.spawn_mutator = Mutator(spawn_args, self.inv_counter)
         self.breeder = Reproduction(self.args)
+        self.compatibility = CompatibilityEngine(self.args)
         self.cur_id = 1
         self.species_list = [] # List of different species
         self.stagnation = Stagnation(self.args)
         self.orgs = []
         self.generation = 0
         self.dynamic_archive = DynamicArchive(self.config)
+        # Replaced by the run's recorder to write the phase timings out
+        self.metrics = GenerationMetrics()
 
 
     def setup(self, net):
@@ -39,11 +50,9 @@ class DynamicPopulation:
         for i in range(pop_size):
             copy_org = base_org.copy(self.cur_id) # Create a copy
             self.cur_id += 1
-            prev_rand = self.args.mutate_link_weight_rand_rate
-            self.args.mutate_link_weight_rand_rate = 1.0
 
-            self.mutator.mutate_link_weights(copy_org.net) # Randomize the link weights
-            self.args.mutate_link_weight_rand_rate = prev_rand
+            self.spawn_mutator.mutate_link_weights(copy_org.net) # Randomize the link weights
+            net_mutated(copy_org.net)
             orgs.append(copy_org) 
         
         return orgs
@@ -66,27 +75,27 @@ class DynamicPopulation:
     
     def respeciate(self):
         """Respeciate the population into different species that better match."""
-        retained_orgs = set()
-        # Keep few best orgs in each species 
-        for species in self.species_list:
-            species.orgs = species.orgs[:self.args.respeciate_size]
-            for org in species.orgs:
-                retained_orgs.add(org.id)
-
-        # Find best matchgin species for each organism 
-        for org in self.orgs:
-            if org.id not in retained_orgs:
-                random.shuffle(self.species_list)
-                min_species_val = None
-                best_species = None
-                for i, cur_species in enumerate(self.species_list):
-                    speciate_val = self.speciate_fn(org.net, cur_species.first().net)
-
-                    if best_species == None or speciate_val < min_species_val:
-                        min_species_val = speciate_val
-                        best_species = cur_species
-                
-                best_species.add(org)
+        with self.metrics.phase("speciation"):
+            self.prune_species()
+            retained_orgs = set()
+            # Keep few best orgs in each species 
+            for species in self.species_list:
+                species.orgs = species.orgs[:self.args.respeciate_size]
+                for org in species.orgs:
+                    retained_orgs.add(org.id)
+
+            # Find best matchgin species for each organism, ties go to a random species
+            random.shuffle(self.species_list)
+            # Pruned species without members have no representative to compare against
+            rep_species = [cur_species for cur_species in self.species_list if len(cur_species.orgs) > 0]
+            unassigned_orgs = [org for org in self.orgs if org.id not in retained_orgs]
+            if len(unassigned_orgs) > 0 and len(rep_species) > 0:
+                speciate_vals = self.compatibility.distances(
+                    [self.genome(org) for org in unassigned_orgs],
+                    [self.genome(cur_species.first()) for cur_species in rep_species])
+
+                for org, species_idx in zip(unassigned_orgs, np.argmin(speciate_vals, axis=1)):
+                    rep_species[species_idx].add(org)
 
     def speciate_fn(self, net_1, net_2):
         """Compare two networks to determine if they should form a new species."""
@@ -114,53 +123,75 @@ class DynamicPopulation:
 
         self.generation += 1
         #self.dynamic_archive.reset()
-        skill_desscriptors, self.orgs = zip(*sorted(zip(skill_descriptors, self.orgs), key= lambda x:x[1].avg_fitness, reverse=True))
-        
-        for i in range(len(skill_descriptors)):
-            self.dynamic_archive.attempt_add_archive(
-                self.orgs[i],
-                skill_descriptors[i])
-        
-        self.orgs = self.dynamic_archive.get_orgs()
-        num_reproduce = max(self.args.init_pop_size - len(self.orgs), self.config.min_reproduce)
-        print("Reproducing ", num_reproduce)
-        new_orgs = []
+        skill_descriptors, self.orgs = zip(*sorted(zip(skill_descriptors, self.orgs), key= lambda x:x[1].avg_fitness, reverse=True))
         
-        min_fitness = min([org.avg_fitness for org in self.orgs])
-        max_fitness = max([org.avg_fitness for org in self.orgs])
+        with self.metrics.phase("archive"):
+            self.dynamic_archive.attempt_add_batch(self.orgs, skill_descriptors)
+            recall = self.dynamic_archive.measure_recall(skill_descriptors)
+        if recall is not None:
+            self.metrics.set(archive_recall=float(recall))
+
+        with self.metrics.phase("selection"):
+            self.orgs = self.dynamic_archive.get_orgs()
+            num_reproduce = max(self.args.init_pop_size - len(self.orgs), self.config.min_reproduce)
+
+            for org in self.orgs:
+                org.age += 1
+            fitness_probs = self.selection_probs(self.orgs)
+
+            # Draw every parent pair in one go
+            parent_idxs = np.random.choice(len(self.orgs), size=(num_reproduce, 2), p=fitness_probs)
+        new_orgs = self.breed([self.orgs[i] for i in parent_idxs[:, 0]], [self.orgs[i] for i in parent_idxs[:, 1]])
+
+        with self.metrics.phase("speciation"):
+            for created_org in new_orgs:
+                self.species_list[0].add(
+                   created_org)
+
+            self.orgs = self.orgs + new_orgs
+            # Organisms that left the population and the archive would otherwise stay referenced by their species
+            self.prune_species()
+        self.metrics.set(num_reproduce=num_reproduce, species=len(self.species_list), **self.memory_report())
+
+    def selection_probs(self, orgs):
+        """Set the organisms' adjusted fitness and get their fitness-proportional selection probabilities."""
+        min_fitness = min([org.avg_fitness for org in orgs])
+        max_fitness = max([org.avg_fitness for org in orgs])
         
         if min_fitness == max_fitness:
             min_fitness -= 0.01
         
         fitness_sum = 0
-        for org in self.orgs:
-            org.age += 1
+        for org in orgs:
             org.adj_fitness = (org.avg_fitness - min_fitness) / (max_fitness - min_fitness)
             fitness_sum += org.adj_fitness
         
         fitness_probs = []
-        for org in self.orgs:
+        for org in orgs:
             fitness_probs.append(org.adj_fitness / fitness_sum)
-        
-        for i in range(num_reproduce):
-            parent_1 = np.random.choice(self.orgs, p=fitness_probs)
-            parent_2 = np.random.choice(self.orgs, p=fitness_probs)
+        return fitness_probs
+
+    def breed(self, parents_1, parents_2):
+        """Create a mutated child for every pair of parents."""
+        return [self.reproduce(parent_1, parent_2) for parent_1, parent_2 in zip(parents_1, parents_2)]
 
+    def reproduce(self, parent_1, parent_2):
+        """Create a mutated child of two parents."""
+        with self.metrics.phase("crossover"):
             child_net = self.breeder.reproduce_directional(
                 parent_1.net, parent_2.net, parent_1.avg_fitness, parent_2.avg_fitness)
 
+        with self.metrics.phase("mutation"):
             self.mutate_child(child_net)
-            created_org = Organism(self.args, child_net, gen=max(parent_1.generation, parent_2.generation) + 1, id=self.cur_id) 
-            self.species_list[0].add(
-               created_org)
-            new_orgs.append(created_org)
-            
-            # Increment the current organism ID
-            self.cur_id += 1
-        
-        self.orgs = self.orgs + new_orgs
-        print("len(self.orgs)", len(self.orgs))
+        created_org = Organism(self.args, child_net, gen=max(parent_1.generation, parent_2.generation) + 1, id=self.cur_id)
+
+        # Increment the current organism ID
+        self.cur_id += 1
+        return created_org
 
+    def genome(self, org):
+        """Get what speciation compares for an organism."""
+        return org.net
 
     def mutate_child(self, child_net):
         if random.random() <= self.args.mutate_add_node_rate:
@@ -171,6 +202,8 @@ class DynamicPopulation:
         
         if random.random() <= self.args.mutate_link_weight_rate:
             self.mutator.mutate_link_weights(child_net)
+        # Evaluators convert nets to genomes once, until the mutator changes them
+        net_mutated(child_net)
 
     def reset(self):
         """Reset all the organsisms in the population."""
@@ -0,0 +1,147 @@
+import copy, queue, random
+import multiprocessing
+import numpy as np
+from collections import namedtuple
+
+from neat_dynamics.evaluation.rollout import SerialEvaluator
+from neat_dynamics.evaluation.vectorized import VectorizedEvaluator
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+from neat_dynamics.neat.array_genome import ArrayGenome, CompactOrganism, pack_genomes, unpack_genomes
+from neat_dynamics.neat.compact_population import CompactPopulation
+
+# Each island draws new node and gene ids from its own range so structural innovations never collide
+ISLAND_NODE_STRIDE = 1 << 24
+ISLAND_GENE_STRIDE = 1 << 40
+
+def island_config(config, island, num_islands):
+    """Get an island's config, spreading novel_threshold geometrically around the configured one."""
+    scale = config.island_threshold_spread ** (island - (num_islands - 1) / 2)
+    return config._replace(novel_threshold=config.novel_threshold * scale)
+
+def select_migrants(population, num_migrants):
+    """Get the most novel archive members that still hold their genome."""
+    archive = population.dynamic_archive
+    resident = [archive.novel_archive[org.id] for org in archive.get_orgs()]
+    resident.sort(key=lambda repo_org: repo_org.novelty_score, reverse=True)
+    return [repo_org.org for repo_org in resident[:num_migrants]]
+
+def accept_migrants(population, packed_migrants, fitnesses):
+    """Add migrants to the population under fresh ids, they are evaluated with the next generation."""
+    for genome, fitness in zip(unpack_genomes(*packed_migrants).values(), fitnesses):
+        org = CompactOrganism(genome, id=population.cur_id)
+        org.avg_fitness = fitness
+        population.cur_id += 1
+        population.orgs.append(org)
+        population.species_list[0].add(org)
+
+def run_island(island, args, config_dict, spec, seed_seq, inbox, outbox, reports, num_generations):
+    """Evolve one island, sending migrants to the next island and taking in those sent to it.
+
+    Every generation's metrics record goes to reports, tagged with the island.
+    """
+    # The config travels as a dict, its namedtuple class only exists in the parent process
+    config = namedtuple("GenericDict", config_dict.keys())(**config_dict)
+    seed = seed_seq.generate_state(1)[0]
+    random.seed(int(seed))
+    np.random.seed(seed)
+    island_args = copy.copy(args)
+    island_args.seed = int(seed)
+
+    evaluator = VectorizedEvaluator(island_args, spec) if args.vectorized else SerialEvaluator(island_args, spec)
+    population = CompactPopulation(island_args, config, evaluator.num_inputs, evaluator.num_outputs)
+    population.setup_genome(ArrayGenome.initial(evaluator.num_inputs, evaluator.num_outputs))
+    population.innovations.next_node_id += island * ISLAND_NODE_STRIDE
+    population.innovations.next_gene_id += island * ISLAND_GENE_STRIDE
+    # Records are sent to the parent, which writes them out
+    metrics = GenerationMetrics()
+    population.metrics = metrics
+
+    for generation in range(num_generations):
+        metrics.start_generation(generation)
+        with metrics.phase("evaluation"):
+            results = evaluator.evaluate(population.orgs)
+            population.evolve([result.skill_descriptor for result in results])
+
+        with metrics.phase("migration"):
+            migrants_sent = 0
+            if (generation + 1) % config.migration_interval == 0:
+                migrants = select_migrants(population, config.num_migrants)
+                outbox.put((
+                    pack_genomes([org.id for org in migrants], [org.genome for org in migrants]),
+                    [org.avg_fitness for org in migrants]))
+                migrants_sent = len(migrants)
+
+            # Migration is asynchronous, take whatever has arrived without waiting for it
+            migrants_received = 0
+            while True:
+                try:
+                    packed_migrants, fitnesses = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                accept_migrants(population, packed_migrants, fitnesses)
+                migrants_received += len(fitnesses)
+
+        metrics.set(
+            island=island,
+            novel_threshold=config.novel_threshold,
+            best_fitness=float(max(result.fitness for result in results)),
+            migrants_sent=migrants_sent,
+            migrants_received=migrants_received)
+        reports.put(metrics.end_generation())
+
+    evaluator.close()
+
+class IslandModel:
+    """Runs several CompactPopulations in their own processes, arranged in a ring.
+
+    Each island has its own DynamicArchive with its own novel_threshold.
+    Every migration_interval generations an island sends its num_migrants
+    most novel archive members, as packed genome arrays, to the next island
+    through a multiprocessing queue. Each island records its generations
+    itself, the records are written through metrics as they arrive.
+    """
+    def __init__(self, args, config, spec):
+        self.args = args
+        self.config = config
+        self.spec = spec
+        self.num_islands = args.islands
+        # Replaced by the run's recorder to write the island records out
+        self.metrics = GenerationMetrics()
+
+    def run(self, num_generations):
+        """Evolve every island for num_generations and get their generation records as they arrive."""
+        inboxes = [multiprocessing.Queue() for _ in range(self.num_islands)]
+        reports = multiprocessing.Queue()
+        seed_seqs = np.random.SeedSequence(self.args.seed).spawn(self.num_islands)
+        processes = []
+        for island in range(self.num_islands):
+            processes.append(multiprocessing.Process(
+                target=run_island,
+                args=(
+                    island,
+                    self.args,
+                    island_config(self.config, island, self.num_islands)._asdict(),
+                    self.spec,
+                    seed_seqs[island],
+                    inboxes[island],
+                    inboxes[(island + 1) % self.num_islands],
+                    reports,
+                    num_generations)))
+            processes[-1].start()
+
+        num_reports = 0
+        while num_reports < self.num_islands * num_generations:
+            try:
+                record = reports.get(timeout=1.0)
+            except queue.Empty:
+                # Stop waiting on islands that died
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+
+            num_reports += 1
+            self.metrics.write(record)
+            yield record
+
+        for process in processes:
+            process.join()
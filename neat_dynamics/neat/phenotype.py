@@ -0,0 +1,202 @@
+import numpy as np
+from collections import OrderedDict
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+class CompiledNetwork:
+    """Executable form of an ArrayGenome.
+
+    Non-input nodes are grouped into layers by their longest feed-forward path
+    from the inputs, and each layer's incoming links are gathered into arrays so
+    a step is one weighted bincount per layer. Links that close a cycle are
+    recurrent: their source has not been updated yet when they are read, so
+    they carry the previous step's activation.
+    """
+    __slots__ = ("num_inputs", "num_outputs", "num_nodes", "biases", "layers", "link_rows", "values")
+
+    def __init__(self, genome):
+        self.num_inputs = genome.num_inputs
+        self.num_outputs = genome.num_outputs
+        node_ids = genome.nodes["id"]
+        self.num_nodes = len(node_ids)
+        self.biases = genome.nodes["bias"].copy()
+
+        links = genome.links[genome.links["enabled"]]
+        is_input = np.arange(self.num_nodes) < self.num_inputs
+        self._compile(
+            np.searchsorted(node_ids, links["src"]),
+            np.searchsorted(node_ids, links["dst"]),
+            links["weight"],
+            is_input)
+
+    def _compile(self, srcs, dsts, weights, is_input):
+        """Group the non-input nodes into layers along with the links that feed them."""
+        recurrent = self._recurrent_links(srcs, dsts)
+        node_layers = self._node_layers(srcs[~recurrent], dsts[~recurrent], is_input)
+
+        # Per layer: node positions and the links feeding them, with the destination relative to the layer
+        self.layers = []
+        # Per layer: rows of its links in the enabled links, to gather new weights from
+        self.link_rows = []
+        for layer in range(1, int(node_layers.max(initial=0)) + 1):
+            layer_nodes = np.flatnonzero(node_layers == layer)
+            feeding = np.isin(dsts, layer_nodes)
+            local_dsts = np.searchsorted(layer_nodes, dsts[feeding])
+            self.layers.append((layer_nodes, srcs[feeding], local_dsts, weights[feeding]))
+            self.link_rows.append(np.flatnonzero(feeding))
+
+        self.values = np.zeros(self.num_nodes)
+
+    def _recurrent_links(self, srcs, dsts):
+        """Mark the links that close a cycle when nodes are visited depth first from the inputs."""
+        children = [[] for _ in range(self.num_nodes)]
+        for link_idx, (src, dst) in enumerate(zip(srcs.tolist(), dsts.tolist())):
+            children[src].append((dst, link_idx))
+
+        recurrent = np.zeros(len(srcs), dtype=bool)
+        # 0 unvisited, 1 on the current path, 2 finished
+        state = [0] * self.num_nodes
+        for root in range(self.num_nodes):
+            if state[root] != 0:
+                continue
+            state[root] = 1
+            stack = [(root, iter(children[root]))]
+            while len(stack) > 0:
+                node, remaining = stack[-1]
+                for dst, link_idx in remaining:
+                    if state[dst] == 1:
+                        recurrent[link_idx] = True
+                    elif state[dst] == 0:
+                        state[dst] = 1
+                        stack.append((dst, iter(children[dst])))
+                        break
+                else:
+                    state[node] = 2
+                    stack.pop()
+
+        return recurrent
+
+    def _node_layers(self, srcs, dsts, is_input):
+        """Get every node's longest feed-forward distance from the inputs, inputs are layer 0."""
+        layers = np.where(is_input, 0, 1)
+        # Relax until stable, the feed-forward links form a DAG so this takes at most num_nodes passes
+        for _ in range(self.num_nodes):
+            candidate = np.zeros(self.num_nodes, dtype=np.int64)
+            np.maximum.at(candidate, dsts, layers[srcs] + 1)
+            updated = np.maximum(layers, candidate)
+            updated[is_input] = 0
+            if np.array_equal(updated, layers):
+                break
+            layers = updated
+
+        return layers
+
+    def update_weights(self, genome):
+        """Take the weights and biases of a genome whose structure matches the compiled one."""
+        weights = genome.links["weight"][genome.links["enabled"]]
+        self.biases = genome.nodes["bias"].copy()
+        self.layers = [
+            (layer_nodes, srcs, local_dsts, weights[rows])
+            for (layer_nodes, srcs, local_dsts, _), rows in zip(self.layers, self.link_rows)]
+
+    def activate(self, inputs):
+        """Run one step and get the output activations."""
+        self.values[:self.num_inputs] = inputs
+        self._propagate()
+        return self.values[self.num_inputs:self.num_inputs + self.num_outputs]
+
+    def _propagate(self):
+        values = self.values
+        for layer_nodes, srcs, local_dsts, weights in self.layers:
+            totals = np.bincount(local_dsts, weights=weights * values[srcs], minlength=len(layer_nodes))
+            values[layer_nodes] = sigmoid(self.biases[layer_nodes] + totals)
+
+    def reset(self):
+        """Clear the activations carried by recurrent links."""
+        self.values = np.zeros(self.num_nodes)
+
+class PhenotypeCache:
+    """LRU cache of CompiledNetworks keyed by genome structure.
+
+    A genome that has not changed since it was compiled, such as an archived
+    elite evaluated again, gets its network back without compiling. One whose
+    weights were mutated since has the cached network patched with the new
+    weights, a structural mutation gives the genome a new structure number
+    and so a fresh compile. The activations of a returned network are not
+    cleared, rollouts reset the network before every episode.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # Structure number to the version compiled and its network, least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.patches = 0
+        self.misses = 0
+
+    def get(self, genome):
+        """Get the compiled network of a genome."""
+        if self.capacity <= 0:
+            return CompiledNetwork(genome)
+
+        entry = self.entries.pop(genome.structure, None)
+        if entry is None:
+            self.misses += 1
+            net = CompiledNetwork(genome)
+        else:
+            version, net = entry
+            if version == genome.version:
+                self.hits += 1
+            else:
+                self.patches += 1
+                net.update_weights(genome)
+
+        self.entries[genome.structure] = (genome.version, net)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return net
+
+class BatchedNetwork(CompiledNetwork):
+    """Many ArrayGenomes compiled into one network for lockstep inference.
+
+    The genomes are laid out as disjoint blocks of one large graph, so their
+    nodes share layers by depth and a step for every organism costs one
+    bincount per layer over the concatenated links. Organisms are independent,
+    so the result matches running each CompiledNetwork on its own.
+    """
+    __slots__ = ("num_orgs", "input_idxs", "output_idxs")
+
+    def __init__(self, genomes):
+        self.num_orgs = len(genomes)
+        self.num_inputs = genomes[0].num_inputs
+        self.num_outputs = genomes[0].num_outputs
+
+        node_counts = np.array([len(genome.nodes) for genome in genomes])
+        offsets = np.concatenate(([0], np.cumsum(node_counts)[:-1]))
+        self.num_nodes = int(node_counts.sum())
+        self.biases = np.concatenate([genome.nodes["bias"] for genome in genomes])
+
+        srcs, dsts, weights = [], [], []
+        for genome, offset in zip(genomes, offsets):
+            links = genome.links[genome.links["enabled"]]
+            srcs.append(np.searchsorted(genome.nodes["id"], links["src"]) + offset)
+            dsts.append(np.searchsorted(genome.nodes["id"], links["dst"]) + offset)
+            weights.append(links["weight"])
+
+        # Inputs then outputs lead every genome's node array
+        self.input_idxs = offsets[:, None] + np.arange(self.num_inputs)
+        self.output_idxs = offsets[:, None] + self.num_inputs + np.arange(self.num_outputs)
+        is_input = np.zeros(self.num_nodes, dtype=bool)
+        is_input[self.input_idxs] = True
+
+        self._compile(
+            np.concatenate(srcs).astype(np.int64),
+            np.concatenate(dsts).astype(np.int64),
+            np.concatenate(weights),
+            is_input)
+
+    def activate(self, inputs):
+        """Run one step for every organism given inputs of shape (num_orgs, num_inputs) and get their outputs."""
+        self.values[self.input_idxs] = inputs
+        self._propagate()
+        return self.values[self.output_idxs]
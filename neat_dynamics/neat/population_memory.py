@@ -0,0 +1,29 @@
+class PopulationMemory:
+    """Bookkeeping of what a population with a DynamicArchive keeps referenced.
+
+    Mixed into populations that hold orgs, species_list and dynamic_archive
+    and define genome(org).
+    """
+    def live_ids(self):
+        """Get the ids of the organisms in the population or held by the archive."""
+        return set(org.id for org in self.orgs) | set(org.id for org in self.dynamic_archive.get_orgs())
+
+    def prune_species(self):
+        """Drop species members that are no longer alive, the species themselves stay for stagnation."""
+        live_ids = self.live_ids()
+        for species in self.species_list:
+            species.orgs = [org for org in species.orgs if org.id in live_ids]
+
+    def memory_report(self):
+        """Get counts of the organisms and genes the population keeps referenced."""
+        live_orgs = {org.id: org for org in self.orgs}
+        for org in self.dynamic_archive.get_orgs():
+            live_orgs.setdefault(org.id, org)
+
+        return {
+            "orgs": len(self.orgs),
+            "species_members": sum(len(species.orgs) for species in self.species_list),
+            "archive_members": len(self.dynamic_archive.novel_archive),
+            "resident_archive_orgs": len(self.dynamic_archive.get_orgs()),
+            "live_orgs": len(live_orgs),
+            "live_genes": sum(len(self.genome(org).links) for org in live_orgs.values())}
@@ -0,0 +1,93 @@
+import queue
+import numpy as np
+
+from neat_dynamics.evaluation.parallel import ParallelEvaluator
+from neat_dynamics.metrics.generation_metrics import GenerationMetrics
+from neat_dynamics.neat.array_genome import ArrayGenome
+from neat_dynamics.neat.compact_population import CompactPopulation
+
+class SteadyStateEvolution:
+    """Evolves without generation barriers, keeping every evaluation worker busy.
+
+    Each returned evaluation is offered to the archive straight away, and a
+    child bred from the archive's resident organisms with the same
+    fitness-proportional selection as DynamicPopulation.evolve takes its
+    place on the pool. A slow episode only holds up its own worker. Every
+    init_pop_size evaluations count as a generation for ages, innovation ids
+    and species pruning, and get a metrics record.
+    """
+    def __init__(self, args, config, spec):
+        self.args = args
+        self.config = config
+        self.evaluator = ParallelEvaluator(args, spec)
+        self.population = CompactPopulation(args, config, self.evaluator.num_inputs, self.evaluator.num_outputs)
+        self.population.setup_genome(ArrayGenome.initial(self.evaluator.num_inputs, self.evaluator.num_outputs))
+        # Organisms out on the pool keyed by id, and evaluations as they come back
+        self.in_flight = {}
+        self.done = queue.Queue()
+        self.num_evaluated = 0
+        # Replaced by the run's recorder, together with the population's, to write the records out
+        self.metrics = GenerationMetrics()
+        self.population.metrics = self.metrics
+
+    def submit(self, org):
+        self.in_flight[org.id] = org
+        self.evaluator.submit(org, lambda org, result: self.done.put((org, result)), lambda error: self.done.put((None, error)))
+
+    def run(self, num_evaluations):
+        """Evolve for num_evaluations evaluations and get the record of every generation as it ends."""
+        self.metrics.start_generation(self.population.generation)
+        # A few tasks queued per worker so none idles while the next child is bred
+        for org in self.population.orgs[:2 * self.args.workers]:
+            self.submit(org)
+        unsubmitted = self.population.orgs[2 * self.args.workers:]
+
+        while self.num_evaluated < num_evaluations:
+            # Time spent waiting on the workers
+            with self.metrics.phase("evaluation"):
+                org, result = self.done.get()
+            if org is None:
+                raise result
+
+            del self.in_flight[org.id]
+            org.avg_fitness = result.fitness
+            with self.metrics.phase("archive"):
+                self.population.dynamic_archive.attempt_add_archive(org, result.skill_descriptor)
+            self.num_evaluated += 1
+            if self.num_evaluated % self.args.init_pop_size == 0:
+                yield self.end_generation()
+                self.metrics.start_generation(self.population.generation)
+
+            # Finish evaluating the initial population before breeding
+            with self.metrics.phase("breeding"):
+                if len(unsubmitted) > 0:
+                    self.submit(unsubmitted.pop())
+                else:
+                    self.submit(self.breed())
+
+        self.evaluator.close()
+
+    def breed(self):
+        """Create one child from two parents drawn from the archive's resident organisms."""
+        parents = self.population.dynamic_archive.get_orgs()
+        fitness_probs = self.population.selection_probs(parents)
+        parent_1, parent_2 = np.random.choice(len(parents), size=2, p=fitness_probs)
+        child = self.population.breed([parents[parent_1]], [parents[parent_2]])[0]
+        self.population.species_list[0].add(child)
+        return child
+
+    def end_generation(self):
+        """Age the archive, prune the species and get the finished generation's metrics record."""
+        population = self.population
+        population.generation += 1
+        population.innovations.new_generation()
+        for org in population.dynamic_archive.get_orgs():
+            org.age += 1
+
+        population.orgs = list(self.in_flight.values())
+        population.prune_species()
+        self.metrics.set(
+            evaluations=self.num_evaluated,
+            best_fitness=max(org.avg_fitness for org in population.dynamic_archive.get_orgs()),
+            **population.memory_report())
+        return self.metrics.end_generation()
@@ -1,104 +1,313 @@
+import bisect, heapq
 import numpy as np
+from collections import OrderedDict
 from dataclasses import dataclass
 from neat.organism import Organism
+from neat_dynamics.novelty.neighbor_index import make_neighbor_index, pairwise_dists
+
+# Extra archive neighbors fetched per candidate in a batch, covers members replaced earlier in the batch
+BATCH_NEIGHBOR_MARGIN = 4
+# Number of descriptors used to measure the recall of an approximate index
+RECALL_QUERIES = 16
 
 @dataclass
 class RepoOrgansim:
     org: Organism
     novelty_score: float
-    skill_descriptor: list
+    skill_descriptor: np.ndarray
 
 @dataclass
-class Neighbor:
-    repo_org: RepoOrgansim
-    dist: float
-    idx: int
+class ArchivedOrganism:
+    """Stands in for an archived organism whose network was released."""
+    id: int
+    avg_fitness: float
+    generation: int
 
 class DynamicArchive:
-    """Measures the novelty-based on the final state of an organism.""" 
+    """Measures the novelty-based on the final state of an organism."""
     def __init__(self, config):
         self.config = config
-        # List of novel final states 
-        self.novel_archive = []
-        self.org_id_set = set()
+        # Novel final states keyed by organism id, in insertion order
+        self.novel_archive = {}
+        # Keys of the members still holding their full organism, oldest first
+        self._resident = OrderedDict()
+        self.index = make_neighbor_index(self.config)
+        # Each member's k nearest other members, the members listing each key,
+        # each member's k-th distance and a lazy max-heap over those distances
+        self._neighbors = {}
+        self._reverse_neighbors = {}
+        self._radii = {}
+        self._radius_heap = []
 
     def attempt_add_archive(self, org, skill_descriptor):
         # Don't readd organsims already in the archive
-        if org.id in self.org_id_set:
+        if org.id in self.novel_archive:
             return
 
+        skill_descriptor = np.asarray(skill_descriptor, dtype=np.float64)
         if len(self.novel_archive) <= self.config.min_archive_size:
             # Add organsim if the archive size isn't big enough yet
-            self.novel_archive.append(
-                RepoOrgansim(org, self.config.novel_threshold, skill_descriptor))
-            self.org_id_set.add(org.id)
+            self._add(RepoOrgansim(org, self.config.novel_threshold, skill_descriptor.copy()))
         else:
-            dists = []
-            for i, repo_org in enumerate(self.novel_archive):
-                dists.append(
-                    Neighbor(
-                        repo_org,
-                        self._dist(skill_descriptor, repo_org.skill_descriptor),
-                        i))
-            
-            dists = sorted(dists, key=lambda x: x.dist)
-
-
-            novelty_score = self.avg_dist(dists)
-
-            if dists[0].dist >= self.config.novel_threshold:
-                added_repo_org = RepoOrgansim(org, novelty_score, skill_descriptor.copy())
-                self.novel_archive.append(added_repo_org)
-                self.org_id_set.add(org.id)
-
-            elif dists[0].dist < self.config.novel_threshold and dists[1].dist >= self.config.novel_threshold:
-                if dists[0].repo_org.novelty_score < novelty_score or dists[0].repo_org.org.avg_fitness < org.avg_fitness:
-                    # Remove the other from the archive
-                    del self.novel_archive[dists[0].idx]
-                    self.org_id_set.remove(dists[0].repo_org.org.id)
-
-                    # Add the new one to the archive
-                    added_repo_org = RepoOrgansim(org, novelty_score, skill_descriptor.copy())
-                    self.novel_archive.append(added_repo_org)
-                    self.org_id_set.add(org.id)
-
-            # if novelty_score >= self.config.novel_threshold:
-            #     added_repo_org = RepoOrgansim(org, novelty_score, skill_descriptor.copy())
-            #     self.novel_archive.append(added_repo_org)
-            #     self.org_id_set.add(org.id)
-            # elif dists[0].repo_org.org.avg_fitness < org.avg_fitness:
-            #     # Remove the other from the archive
-            #     del self.novel_archive[dists[0].idx]
-            #     self.org_id_set.remove(dists[0].repo_org.org.id)
-
-            #     # Add the new one to the archive
-            #     added_repo_org = RepoOrgansim(org, novelty_score, skill_descriptor.copy())
-            #     self.novel_archive.append(added_repo_org)
-            #     self.org_id_set.add(org.id)
+            nearest_dists, nearest_keys = self.index.query(skill_descriptor, self._num_nearest())
+            novelty_score = self.avg_dist(nearest_dists)
+            added, replaced_key = self._admit(org, novelty_score, nearest_dists, nearest_keys)
+            if replaced_key is not None:
+                # Remove the other from the archive
+                self._remove(replaced_key)
+
+            if added:
+                self._add(RepoOrgansim(org, novelty_score, skill_descriptor.copy()), nearest_dists, nearest_keys)
+
+        self._release_orgs()
+
+    def attempt_add_batch(self, orgs, skill_descriptors):
+        """Offer organisms to the archive in order, giving the same archive as calling attempt_add_archive on each."""
+        if len(orgs) == 0:
+            return
+
+        candidates = np.atleast_2d(np.asarray(skill_descriptors, dtype=np.float64))
+        num_nearest = self._num_nearest()
+        # Neighbors among the archive as it was before the batch
+        prefetched = self.index.query_batch(candidates, num_nearest + BATCH_NEIGHBOR_MARGIN)
+        candidate_dists = pairwise_dists(candidates, candidates)
+
+        # Candidates currently in the archive and members of the old archive removed during the batch
+        candidate_idxs = {}
+        removed_keys = set()
+
+        for i, org in enumerate(orgs):
+            # Don't readd organsims already in the archive
+            if org.id in self.novel_archive:
+                continue
+
+            if len(self.novel_archive) <= self.config.min_archive_size:
+                self._add(RepoOrgansim(org, self.config.novel_threshold, candidates[i].copy()))
+                candidate_idxs[org.id] = i
+                continue
+
+            nearest_dists, nearest_keys = self._batch_neighbors(
+                i, orgs, candidates, prefetched, candidate_dists, candidate_idxs, removed_keys)
+            novelty_score = self.avg_dist(nearest_dists)
+            added, replaced_key = self._admit(org, novelty_score, nearest_dists, nearest_keys)
+            if replaced_key is not None:
+                self._remove(replaced_key)
+                if replaced_key in candidate_idxs:
+                    del candidate_idxs[replaced_key]
+                else:
+                    removed_keys.add(replaced_key)
+
+            if added:
+                self._add(RepoOrgansim(org, novelty_score, candidates[i].copy()), nearest_dists, nearest_keys)
+                candidate_idxs[org.id] = i
+
+        self._release_orgs()
+
+    def _batch_neighbors(self, i, orgs, candidates, prefetched, candidate_dists, candidate_idxs, removed_keys):
+        """Get the nearest neighbors of candidate i among the archive as it stands at that point of the batch."""
+        num_nearest = self._num_nearest()
+        archive_dists, archive_keys = self._drop_keys(prefetched[i], removed_keys)
+        if len(archive_keys) < min(num_nearest, len(self.index) - len(candidate_idxs)):
+            # Too many prefetched neighbors were replaced, search again
+            archive_dists, archive_keys = self._drop_keys(
+                self.index.query(candidates[i], num_nearest + len(candidate_idxs)),
+                removed_keys | candidate_idxs.keys())
+
+        accepted_idxs = sorted(candidate_idxs.values())
+        dists = np.concatenate([archive_dists, candidate_dists[i, accepted_idxs]])
+        keys = np.concatenate([archive_keys, [orgs[j].id for j in accepted_idxs]]).astype(np.int64)
+        order = np.argsort(dists, kind="stable")[:num_nearest]
+        return dists[order], keys[order]
+
+    def _drop_keys(self, neighbors, dropped_keys):
+        dists, keys = neighbors
+        if len(dropped_keys) == 0:
+            return dists, keys
+
+        kept = np.array([key not in dropped_keys for key in keys.tolist()], dtype=bool)
+        return dists[kept], keys[kept]
+
+    def would_admit(self, skill_descriptor, fitness):
+        """Get whether an organism with this descriptor and fitness would enter the archive as it stands."""
+        if len(self.novel_archive) <= self.config.min_archive_size:
+            return True
+
+        nearest_dists, nearest_keys = self.index.query(np.asarray(skill_descriptor, dtype=np.float64), self._num_nearest())
+        added, _ = self._admit(ArchivedOrganism(None, fitness, 0), self.avg_dist(nearest_dists), nearest_dists, nearest_keys)
+        return added
+
+    def outclassed(self, skill_descriptor, fitness):
+        """Get whether the nearest member lies within novel_threshold of the descriptor with at least this fitness."""
+        if len(self.novel_archive) <= self.config.min_archive_size:
+            return False
+
+        nearest_dists, nearest_keys = self.index.query(np.asarray(skill_descriptor, dtype=np.float64), 1)
+        return bool(nearest_dists[0] < self.config.novel_threshold
+            and self.novel_archive[int(nearest_keys[0])].org.avg_fitness >= fitness)
+
+    def _admit(self, org, novelty_score, nearest_dists, nearest_keys):
+        """Get whether the organism enters the archive and the key of the member it replaces."""
+        if nearest_dists[0] >= self.config.novel_threshold:
+            return True, None
+
+        elif nearest_dists[0] < self.config.novel_threshold and self._second_dist(nearest_dists) >= self.config.novel_threshold:
+            nearest_repo_org = self.novel_archive[int(nearest_keys[0])]
+            if nearest_repo_org.novelty_score < novelty_score or nearest_repo_org.org.avg_fitness < org.avg_fitness:
+                return True, int(nearest_keys[0])
 
+        return False, None
 
     def avg_dist(self, dists):
         """Get the average distance for novelty score assuming dists is sorted."""
-        dist_sum = 0
         num_neighbors = min(self.config.novelty_neighbors, len(dists))
+        return float(np.mean(dists[:num_neighbors]))
 
-        for i in range(num_neighbors):
-            dist_sum += dists[i].dist
+    def _num_nearest(self):
+        # The replacement rule always looks at the two closest members
+        return max(self.config.novelty_neighbors, 2)
 
-        return dist_sum / num_neighbors
+    def _second_dist(self, dists):
+        # A lone neighbor leaves nothing else in the threshold ball
+        return dists[1] if len(dists) > 1 else np.inf
+
+    def measure_recall(self, skill_descriptors):
+        """Get the recall of the approximate neighbor search against exact search, None if the search is exact."""
+        if not self.index.approximate or len(self.index) == 0:
+            return None
+
+        queries = np.atleast_2d(np.asarray(skill_descriptors, dtype=np.float64))[:RECALL_QUERIES]
+        return self.index.measure_recall(queries, self._num_nearest())
+
+    def _add(self, repo_org, nearest_dists=None, nearest_keys=None):
+        if self.config.incremental_novelty:
+            self._track_add(repo_org, nearest_dists, nearest_keys)
+        self._store(repo_org)
+        self.index.insert(repo_org.org.id, repo_org.skill_descriptor)
+
+    def _remove(self, key):
+        self._discard(key)
+        self.index.remove(key)
+        if self.config.incremental_novelty:
+            self._track_remove(key)
+
+    def _track_add(self, repo_org, nearest_dists, nearest_keys):
+        """Give a new member its neighborhood and update only the members it moves into the neighborhood of."""
+        key = repo_org.org.id
+        if nearest_keys is None or any(int(k) not in self.novel_archive for k in nearest_keys):
+            # The neighbors were found before a replacement or not at all
+            nearest_dists, nearest_keys = self.index.query(repo_org.skill_descriptor, self.config.novelty_neighbors)
+        self._set_neighbors(key, nearest_dists, nearest_keys)
+        repo_org.novelty_score = self._tracked_novelty(key)
+
+        # Only members whose k-th neighbor is farther than the new member can change
+        dists, keys = self.index.query_radius(repo_org.skill_descriptor, self._max_radius())
+        for dist, member_key in zip(dists.tolist(), keys.tolist()):
+            if dist < self._radii[member_key]:
+                self._insert_neighbor(member_key, dist, key)
+
+    def _track_remove(self, key):
+        """Drop a member's neighborhood and refill the neighborhoods it was part of."""
+        self._drop_neighbors(key)
+        for member_key in self._reverse_neighbors.pop(key, set()):
+            member = self.novel_archive[member_key]
+            dists, keys = self.index.query(member.skill_descriptor, self.config.novelty_neighbors + 1)
+            # Skip the member itself
+            own = keys != member_key
+            self._drop_neighbors(member_key)
+            self._set_neighbors(member_key, dists[own], keys[own])
+            member.novelty_score = self._tracked_novelty(member_key)
+
+    def _set_neighbors(self, key, dists, keys):
+        dists = dists[:self.config.novelty_neighbors].tolist()
+        keys = keys[:self.config.novelty_neighbors].tolist()
+        self._neighbors[key] = (dists, keys)
+        for neighbor_key in keys:
+            self._reverse_neighbors.setdefault(neighbor_key, set()).add(key)
+        self._update_radius(key)
+
+    def _insert_neighbor(self, key, dist, neighbor_key):
+        dists, keys = self._neighbors[key]
+        pos = bisect.bisect_right(dists, dist)
+        dists.insert(pos, dist)
+        keys.insert(pos, neighbor_key)
+        self._reverse_neighbors.setdefault(neighbor_key, set()).add(key)
+        if len(keys) > self.config.novelty_neighbors:
+            dists.pop()
+            self._reverse_neighbors[keys.pop()].discard(key)
+
+        self._update_radius(key)
+        self.novel_archive[key].novelty_score = self._tracked_novelty(key)
+
+    def _drop_neighbors(self, key):
+        _, keys = self._neighbors.pop(key)
+        del self._radii[key]
+        for neighbor_key in keys:
+            reverse = self._reverse_neighbors.get(neighbor_key)
+            if reverse is not None:
+                reverse.discard(key)
+
+    def _update_radius(self, key):
+        """Store the distance a new member must beat to enter the neighborhood of key."""
+        dists, _ = self._neighbors[key]
+        radius = dists[-1] if len(dists) >= self.config.novelty_neighbors else np.inf
+        self._radii[key] = radius
+        heapq.heappush(self._radius_heap, (-radius, key))
+
+        if len(self._radius_heap) > 2 * len(self._radii) + 64:
+            self._radius_heap = [(-cur_radius, cur_key) for cur_key, cur_radius in self._radii.items()]
+            heapq.heapify(self._radius_heap)
+
+    def _max_radius(self):
+        # Drop heap entries left behind by neighborhoods that have since changed
+        while len(self._radius_heap) > 0:
+            neg_radius, key = self._radius_heap[0]
+            if self._radii.get(key) == -neg_radius:
+                return -neg_radius
+            heapq.heappop(self._radius_heap)
+
+        return 0.0
+
+    def _tracked_novelty(self, key):
+        dists, _ = self._neighbors[key]
+        if len(dists) == 0:
+            return self.config.novel_threshold
+        # Plain sum, np.mean costs more than the update itself on k floats
+        return sum(dists) / len(dists)
+
+    def _store(self, repo_org):
+        self.novel_archive[repo_org.org.id] = repo_org
+        self._resident[repo_org.org.id] = None
+
+    def _discard(self, key):
+        del self.novel_archive[key]
+        self._resident.pop(key, None)
+
+    def _release_orgs(self):
+        """Swap the oldest organisms past max_resident_orgs for lightweight stand-ins."""
+        if self.config.max_resident_orgs <= 0:
+            return
+
+        while len(self._resident) > self.config.max_resident_orgs:
+            key, _ = self._resident.popitem(last=False)
+            org = self.novel_archive[key].org
+            self.novel_archive[key].org = ArchivedOrganism(org.id, org.avg_fitness, org.generation)
+
+    def restore(self, repo_orgs, resident_keys):
+        """Rebuild the archive from its members in insertion order and the keys still holding their organism."""
+        self.reset()
+        for repo_org in repo_orgs:
+            self._add(repo_org)
+        self._resident = OrderedDict((key, None) for key in resident_keys)
 
-    def _dist(self, state_1, state_2):
-        sum_sd = 0
-        # Take the squared difference between all the elements in the state
-        for i in range(len(state_1)):
-            sum_sd += (state_1[i] - state_2[i]) ** 2
-        
-        # Return the L2 distance
-        return sum_sd ** 0.5
-    
     def get_orgs(self):
-        return [o.org for o in self.novel_archive]
-    
+        """Get the archived organisms that still hold their network."""
+        return [self.novel_archive[key].org for key in self._resident]
+
     def reset(self):
-        self.novel_archive = []
-        self.org_id_set = set()
\ No newline at end of file
+        self.novel_archive = {}
+        self._resident = OrderedDict()
+        self.index.reset()
+        self._neighbors = {}
+        self._reverse_neighbors = {}
+        self._radii = {}
+        self._radius_heap = []
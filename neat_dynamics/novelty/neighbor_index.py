@@ -0,0 +1,385 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Number of query rows handled per distance block, bounds the (rows, points, dim) temporary
+DIST_CHUNK_ROWS = 64
+
+def pairwise_dists(queries, points):
+    """Get the L2 distance between every query row and every point row."""
+    queries = np.atleast_2d(queries)
+    dists = np.empty((queries.shape[0], points.shape[0]))
+    for start in range(0, queries.shape[0], DIST_CHUNK_ROWS):
+        end = start + DIST_CHUNK_ROWS
+        diffs = queries[start:end, None, :] - points[None, :, :]
+        dists[start:end] = np.sqrt(np.square(diffs).sum(axis=2))
+
+    return dists
+
+class NeighborIndex:
+    """Nearest neighbor lookups over skill descriptors keyed by organism id.
+
+    Returned distances are always computed with pairwise_dists, so every backend
+    reports bit-identical distances for the neighbors it finds.
+    """
+    # Whether query may miss some of the true nearest neighbors
+    approximate = False
+
+    def insert(self, key, descriptor):
+        raise NotImplementedError
+
+    def remove(self, key):
+        raise NotImplementedError
+
+    def query(self, descriptor, k):
+        """Get the distances and keys of the k nearest points, closest first."""
+        raise NotImplementedError
+
+    def query_batch(self, descriptors, k):
+        return [self.query(descriptor, k) for descriptor in descriptors]
+
+    def query_radius(self, descriptor, radius):
+        """Get the distances and keys of every point within radius, in no particular order."""
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+class BruteForceIndex(NeighborIndex):
+    """Exact search over a contiguous descriptor matrix kept in insertion order."""
+    def __init__(self):
+        self.reset()
+
+    def insert(self, key, descriptor):
+        if self._points is None:
+            self._points = np.empty((16, len(descriptor)))
+            self._keys = np.empty(16, dtype=np.int64)
+        elif self._size == len(self._keys):
+            # Double the capacity to keep inserts amortized O(1)
+            self._points = np.concatenate([self._points, np.empty_like(self._points)])
+            self._keys = np.concatenate([self._keys, np.empty_like(self._keys)])
+
+        self._points[self._size] = descriptor
+        self._keys[self._size] = key
+        self._size += 1
+
+    def remove(self, key):
+        row = int(np.flatnonzero(self.keys() == key)[0])
+        # Shift the rows down so ties keep breaking by insertion order
+        self._points[row:self._size - 1] = self._points[row + 1:self._size]
+        self._keys[row:self._size - 1] = self._keys[row + 1:self._size]
+        self._size -= 1
+
+    def query(self, descriptor, k):
+        return self.query_batch(np.atleast_2d(descriptor), k)[0]
+
+    def query_batch(self, descriptors, k):
+        if self._size == 0:
+            return [(np.empty(0), np.empty(0, dtype=np.int64)) for _ in descriptors]
+
+        return [self._select(dists, k) for dists in pairwise_dists(descriptors, self.points())]
+
+    def query_radius(self, descriptor, radius):
+        if self._size == 0:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        dists = pairwise_dists(descriptor, self.points())[0]
+        within = dists <= radius
+        return dists[within], self.keys()[within]
+
+    def _select(self, dists, k):
+        k = min(k, len(dists))
+        nearest = np.argpartition(dists, k - 1)[:k]
+        # Order by distance, breaking ties by insertion order
+        nearest = nearest[np.lexsort((nearest, dists[nearest]))]
+        return dists[nearest], self._keys[nearest]
+
+    def points(self):
+        return self._points[:self._size]
+
+    def keys(self):
+        return self._keys[:self._size]
+
+    def reset(self):
+        self._points = None
+        self._keys = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+class _TreeBlock:
+    """Static KD-tree over a block of points, removed points are tombstoned."""
+    __slots__ = ("points", "keys", "alive", "num_dead", "tree")
+
+    def __init__(self, points, keys):
+        self.points = points
+        self.keys = keys
+        self.alive = np.ones(len(keys), dtype=bool)
+        self.num_dead = 0
+        self.tree = cKDTree(points)
+
+class KDTreeIndex(NeighborIndex):
+    """Exact search using the logarithmic method over static KD-trees.
+
+    Inserts go to a small brute-force buffer. A full buffer is merged with the
+    occupied levels below the first free one into a single tree, so level i
+    holds about buffer_size * 2**i points. Removals tombstone the point and a
+    block is rebuilt once half of it is dead, so no stored position goes stale.
+    """
+    def __init__(self, buffer_size=64):
+        if cKDTree is None:
+            raise ImportError("KDTreeIndex requires scipy")
+
+        self.buffer_size = buffer_size
+        self.reset()
+
+    def insert(self, key, descriptor):
+        self._buffer.insert(key, descriptor)
+        self._size += 1
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def remove(self, key):
+        if key in self._locations:
+            block, row = self._locations.pop(key)
+            block.alive[row] = False
+            block.num_dead += 1
+            if 2 * block.num_dead >= len(block.keys):
+                self._rebuild(block)
+        else:
+            self._buffer.remove(key)
+
+        self._size -= 1
+
+    def query(self, descriptor, k):
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        found_dists, found_keys = self._buffer.query(descriptor, k)
+        found_dists, found_keys = [found_dists], [found_keys]
+        for block in self._levels:
+            if block is not None:
+                rows = self._query_block(block, descriptor, k)
+                found_dists.append(pairwise_dists(descriptor, block.points[rows])[0])
+                found_keys.append(block.keys[rows])
+
+        found_dists = np.concatenate(found_dists)
+        order = np.argsort(found_dists, kind="stable")[:k]
+        return found_dists[order], np.concatenate(found_keys)[order]
+
+    def query_radius(self, descriptor, radius):
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        found_dists, found_keys = self._buffer.query_radius(descriptor, radius)
+        found_dists, found_keys = [found_dists], [found_keys]
+        for block in self._levels:
+            if block is not None:
+                if np.isfinite(radius):
+                    rows = np.asarray(block.tree.query_ball_point(descriptor, radius), dtype=np.int64)
+                else:
+                    rows = np.arange(len(block.keys))
+                rows = rows[block.alive[rows]]
+                dists = pairwise_dists(descriptor, block.points[rows])[0]
+                found_dists.append(dists[dists <= radius])
+                found_keys.append(block.keys[rows][dists <= radius])
+
+        return np.concatenate(found_dists), np.concatenate(found_keys)
+
+    def _query_block(self, block, descriptor, k):
+        """Get the rows of the k nearest live points of a block."""
+        num_alive = len(block.keys) - block.num_dead
+        fetch = k
+        while True:
+            fetch = min(fetch, len(block.keys))
+            _, rows = block.tree.query(descriptor, fetch)
+            rows = np.atleast_1d(rows)
+            rows = rows[block.alive[rows]]
+            if len(rows) >= min(k, num_alive):
+                return rows[:k]
+
+            # Tombstones crowded out live points, look further
+            fetch *= 2
+
+    def _flush(self):
+        points = [self._buffer.points().copy()]
+        keys = [self._buffer.keys().copy()]
+        self._buffer.reset()
+
+        # Merge every occupied level up to the first free one
+        level = 0
+        while level < len(self._levels) and self._levels[level] is not None:
+            block = self._levels[level]
+            points.append(block.points[block.alive])
+            keys.append(block.keys[block.alive])
+            self._levels[level] = None
+            level += 1
+
+        if level == len(self._levels):
+            self._levels.append(None)
+        self._levels[level] = self._build(np.concatenate(points), np.concatenate(keys))
+
+    def _rebuild(self, block):
+        level = next(i for i, cur_block in enumerate(self._levels) if cur_block is block)
+        if block.num_dead == len(block.keys):
+            self._levels[level] = None
+        else:
+            self._levels[level] = self._build(block.points[block.alive], block.keys[block.alive])
+
+    def _build(self, points, keys):
+        block = _TreeBlock(points, keys)
+        for row, key in enumerate(keys.tolist()):
+            self._locations[key] = (block, row)
+
+        return block
+
+    def reset(self):
+        self._buffer = BruteForceIndex()
+        # levels[i] is None or a block of about buffer_size * 2**i points
+        self._levels = []
+        self._locations = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+class IVFIndex(NeighborIndex):
+    """Approximate search with a coarse quantizer over inverted lists.
+
+    Points are assigned to the closest of nlist k-means centroids and a query
+    only scans the lists of its nprobe closest centroids, so raising nprobe
+    trades speed for recall. Search is exact until there are enough points to
+    train the quantizer, which is retrained whenever the index doubles.
+    """
+    approximate = True
+
+    def __init__(self, nlist, nprobe, train_factor=32, kmeans_iters=10):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_factor = train_factor
+        self.kmeans_iters = kmeans_iters
+        self.reset()
+
+    def insert(self, key, descriptor):
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        list_idx = 0 if self._centroids is None else self._assign(descriptor[None])[0]
+        self._lists[list_idx].insert(key, descriptor)
+        self._list_of_key[key] = list_idx
+        self._size += 1
+
+        if self._size >= max(self.train_factor * self.nlist, 2 * self._trained_size):
+            self._train()
+
+    def remove(self, key):
+        self._lists[self._list_of_key.pop(key)].remove(key)
+        self._size -= 1
+
+    def query(self, descriptor, k):
+        return self.query_batch(np.atleast_2d(descriptor), k)[0]
+
+    def query_batch(self, descriptors, k):
+        descriptors = np.atleast_2d(np.asarray(descriptors, dtype=np.float64))
+        if self._centroids is None:
+            return self._lists[0].query_batch(descriptors, k)
+
+        probes = np.argsort(pairwise_dists(descriptors, self._centroids), axis=1)
+        results = []
+        for descriptor, list_idxs in zip(descriptors, probes):
+            found = []
+            num_found = 0
+            # Keep probing past nprobe lists when they hold fewer than k points
+            for list_idx in list_idxs:
+                if len(found) >= self.nprobe and num_found >= min(k, self._size):
+                    break
+                found.append(self._lists[list_idx].query(descriptor, k))
+                num_found += len(found[-1][1])
+
+            found_dists = np.concatenate([dists for dists, _ in found])
+            found_keys = np.concatenate([keys for _, keys in found])
+            order = np.argsort(found_dists, kind="stable")[:k]
+            results.append((found_dists[order], found_keys[order]))
+
+        return results
+
+    def query_radius(self, descriptor, radius):
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        list_idxs = range(len(self._lists))
+        if self._centroids is not None and np.isfinite(radius):
+            list_idxs = np.argsort(pairwise_dists(descriptor, self._centroids)[0])[:self.nprobe]
+
+        found = [self._lists[list_idx].query_radius(descriptor, radius) for list_idx in list_idxs]
+        return np.concatenate([dists for dists, _ in found]), np.concatenate([keys for _, keys in found])
+
+    def exact_query(self, descriptor, k):
+        """Get the true k nearest by scanning every list."""
+        descriptor = np.asarray(descriptor, dtype=np.float64)
+        found = [cur_list.query(descriptor, k) for cur_list in self._lists]
+        found_dists = np.concatenate([dists for dists, _ in found])
+        found_keys = np.concatenate([keys for _, keys in found])
+        order = np.argsort(found_dists, kind="stable")[:k]
+        return found_dists[order], found_keys[order]
+
+    def measure_recall(self, descriptors, k):
+        """Get the fraction of the exact k nearest neighbors the approximate search finds."""
+        num_found = 0
+        num_exact = 0
+        for descriptor, (_, keys) in zip(descriptors, self.query_batch(descriptors, k)):
+            _, exact_keys = self.exact_query(descriptor, k)
+            num_found += len(np.intersect1d(keys, exact_keys))
+            num_exact += len(exact_keys)
+
+        return num_found / max(num_exact, 1)
+
+    def _train(self):
+        points = np.concatenate([cur_list.points() for cur_list in self._lists])
+        keys = np.concatenate([cur_list.keys() for cur_list in self._lists])
+        self._centroids = self._kmeans(points)
+        self._trained_size = len(keys)
+
+        # Reassign every point to its new closest centroid
+        self._lists = [BruteForceIndex() for _ in range(len(self._centroids))]
+        for key, point, list_idx in zip(keys.tolist(), points, self._assign(points)):
+            self._lists[list_idx].insert(key, point)
+            self._list_of_key[key] = list_idx
+
+    def _kmeans(self, points):
+        sample_size = min(len(points), self.train_factor * self.nlist)
+        sample = points[np.random.choice(len(points), sample_size, replace=False)]
+        centroids = sample[np.random.choice(sample_size, min(self.nlist, sample_size), replace=False)]
+        for _ in range(self.kmeans_iters):
+            assignment = np.argmin(pairwise_dists(sample, centroids), axis=1)
+            for i in range(len(centroids)):
+                members = sample[assignment == i]
+                # Empty clusters keep their old centroid
+                if len(members) > 0:
+                    centroids[i] = members.mean(axis=0)
+
+        return centroids
+
+    def _assign(self, points):
+        return np.argmin(pairwise_dists(points, self._centroids), axis=1)
+
+    def reset(self):
+        # Everything lives in a single exact list until the quantizer is trained
+        self._lists = [BruteForceIndex()]
+        self._list_of_key = {}
+        self._centroids = None
+        self._trained_size = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+def make_neighbor_index(config):
+    """Create the neighbor index backend named in the config."""
+    if config.neighbor_index == "brute":
+        return BruteForceIndex()
+    elif config.neighbor_index == "kdtree":
+        return KDTreeIndex()
+    elif config.neighbor_index == "ivf":
+        return IVFIndex(config.ivf_nlist, config.ivf_nprobe)
+    else:
+        raise ValueError("Unknown neighbor_index: {}".format(config.neighbor_index))
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("neat")
+
+from neat_dynamics.config import make_parser, parse_config
+from neat_dynamics.neat.array_genome import ArrayGenome
+from neat_dynamics.neat.checkpoint import Checkpointer
+from neat_dynamics.neat.compact_population import CompactPopulation
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "..", "config.ini")
+NUM_INPUTS = 4
+NUM_OUTPUTS = 2
+
+def make_population(pop_size=30):
+    args = make_parser().parse_args([])
+    args.init_pop_size = pop_size
+    population = CompactPopulation(args, parse_config(CONFIG_FILE), NUM_INPUTS, NUM_OUTPUTS)
+    population.setup_genome(ArrayGenome.initial(NUM_INPUTS, NUM_OUTPUTS))
+    return population
+
+def evolve(population, rng, generations):
+    for _ in range(generations):
+        for org in population.orgs:
+            org.avg_fitness = float(rng.random())
+        population.evolve([rng.uniform(-3, 3, 2) for _ in population.orgs])
+
+def test_save_load_round_trip(tmp_path):
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    population = make_population()
+    checkpointer = Checkpointer(str(tmp_path))
+    # Several saves so the organisms are spread over incremental segments
+    for _ in range(4):
+        evolve(population, rng, 3)
+        checkpointer.save(population)
+
+    restored = make_population()
+    Checkpointer(str(tmp_path)).load(restored)
+
+    assert [org.id for org in restored.orgs] == [org.id for org in population.orgs]
+    for org, restored_org in zip(population.orgs, restored.orgs):
+        assert (org.genome.links == restored_org.genome.links).all()
+        assert (org.genome.nodes == restored_org.genome.nodes).all()
+        assert org.avg_fitness == restored_org.avg_fitness
+        assert org.age == restored_org.age
+    assert restored.generation == population.generation
+    assert restored.cur_id == population.cur_id
+    assert restored.innovations.next_node_id == population.innovations.next_node_id
+    assert restored.innovations.next_gene_id == population.innovations.next_gene_id
+    assert list(restored.dynamic_archive.novel_archive) == list(population.dynamic_archive.novel_archive)
+    for key, member in population.dynamic_archive.novel_archive.items():
+        restored_member = restored.dynamic_archive.novel_archive[key]
+        assert (member.skill_descriptor == restored_member.skill_descriptor).all()
+        assert member.org.avg_fitness == restored_member.org.avg_fitness
+        assert member.org.generation == restored_member.org.generation
+
+    # The restored population evolves on from the checkpoint
+    evolve(restored, rng, 1)
+    assert len(restored.orgs) > 0
+
+def test_unchanged_archive_is_not_rewritten(tmp_path):
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    population = make_population()
+    checkpointer = Checkpointer(str(tmp_path))
+    evolve(population, rng, 3)
+    checkpointer.save(population)
+    num_segments = len(checkpointer.manifest["archive_segments"])
+
+    checkpointer.save(population)
+    assert len(checkpointer.manifest["archive_segments"]) == num_segments
+
+    member = next(iter(population.dynamic_archive.novel_archive.values()))
+    member.org.avg_fitness += 1.0
+    checkpointer.save(population)
+    assert checkpointer.manifest["archive_segments"][-1][1] == 1
+
+    restored = make_population()
+    Checkpointer(str(tmp_path)).load(restored)
+    assert restored.dynamic_archive.novel_archive[member.org.id].org.avg_fitness == member.org.avg_fitness
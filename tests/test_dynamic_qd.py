@@ -0,0 +1,65 @@
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("neat")
+
+from neat_dynamics.novelty.dynamic_qd import DynamicArchive
+
+NUM_BATCHES = 8
+BATCH_SIZE = 48
+
+Config = namedtuple("GenericDict", [
+    "novel_threshold", "novelty_neighbors", "min_archive_size", "neighbor_index",
+    "ivf_nlist", "ivf_nprobe", "max_resident_orgs", "incremental_novelty"])
+
+def make_config(neighbor_index, incremental_novelty):
+    # Probing every list keeps the IVF search exact once its quantizer is trained
+    return Config(
+        novel_threshold=0.5, novelty_neighbors=5, min_archive_size=5, neighbor_index=neighbor_index,
+        ivf_nlist=2, ivf_nprobe=2, max_resident_orgs=0, incremental_novelty=incremental_novelty)
+
+def make_batches():
+    """Get batches of organisms whose descriptors often land within novel_threshold of each other."""
+    rng = np.random.default_rng(0)
+    batches = []
+    cur_id = 0
+    for _ in range(NUM_BATCHES):
+        centers = rng.uniform(0, 10, (BATCH_SIZE // 4, 2))
+        descriptors = np.repeat(centers, 4, axis=0) + rng.normal(0, 0.2, (BATCH_SIZE, 2))
+        orgs = [SimpleNamespace(id=cur_id + i, avg_fitness=float(rng.random()), generation=0)
+            for i in range(BATCH_SIZE)]
+        batches.append((orgs, descriptors))
+        cur_id += BATCH_SIZE
+    return batches
+
+@pytest.mark.parametrize("incremental_novelty", [True, False])
+@pytest.mark.parametrize("neighbor_index", ["brute", "kdtree", "ivf"])
+def test_batch_matches_sequential(neighbor_index, incremental_novelty):
+    if neighbor_index == "kdtree":
+        pytest.importorskip("scipy")
+    config = make_config(neighbor_index, incremental_novelty)
+    sequential = DynamicArchive(config)
+    batched = DynamicArchive(config)
+
+    num_replaced_in_batch = 0
+    for orgs, descriptors in make_batches():
+        batch_ids = {org.id for org in orgs}
+        for org, descriptor in zip(orgs, descriptors):
+            before = batch_ids & sequential.novel_archive.keys()
+            sequential.attempt_add_archive(org, descriptor)
+            num_replaced_in_batch += len(before - sequential.novel_archive.keys())
+        batched.attempt_add_batch(orgs, descriptors)
+
+        assert list(batched.novel_archive) == list(sequential.novel_archive)
+        for key, member in sequential.novel_archive.items():
+            batched_member = batched.novel_archive[key]
+            assert (batched_member.skill_descriptor == member.skill_descriptor).all()
+            assert batched_member.novelty_score == pytest.approx(member.novelty_score)
+
+    # Members admitted earlier in the same batch were replaced
+    assert num_replaced_in_batch > 0
+    if neighbor_index == "ivf":
+        assert batched.index._centroids is not None
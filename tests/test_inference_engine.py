@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from neat_dynamics.dynamics.ensemble_model import make_ensemble_model
+from neat_dynamics.dynamics.inference_engine import InferenceEngine
+
+OB_DIM = 8
+AC_DIM = 4
+NUM_EXPS = 512
+
+Config = namedtuple("GenericDict", [
+    "lr", "hidden_size", "num_hidden", "ensemble_size", "fused_ensemble", "memory_capacity",
+    "batch_size", "prioritized_replay", "per_alpha", "per_beta", "per_eps",
+    "inference_precision", "inference_tolerance"])
+
+def make_config(fused_ensemble, inference_precision):
+    return Config(
+        lr=0.001, hidden_size=64, num_hidden=2, ensemble_size=3, fused_ensemble=fused_ensemble,
+        memory_capacity=NUM_EXPS, batch_size=32, prioritized_replay=False,
+        per_alpha=0.6, per_beta=0.4, per_eps=0.001,
+        inference_precision=inference_precision, inference_tolerance=0.05)
+
+def trained_ensemble(config):
+    """Get a small ensemble trained for a few steps on a full memory of random transitions."""
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    ensemble = make_ensemble_model(config, AC_DIM, OB_DIM)
+    ensemble.replay_memory.add_transitions(
+        rng.standard_normal((NUM_EXPS, OB_DIM)).astype(np.float32),
+        rng.integers(AC_DIM, size=NUM_EXPS),
+        rng.standard_normal(NUM_EXPS).astype(np.float32),
+        rng.standard_normal((NUM_EXPS, OB_DIM)).astype(np.float32),
+        np.zeros(NUM_EXPS, dtype=bool))
+    for _ in range(5):
+        ensemble.train()
+    return ensemble
+
+@pytest.mark.parametrize("fused_ensemble", [True, False])
+@pytest.mark.parametrize("precision", ["fp32", "bf16", "int8"])
+def test_frozen_predictor_within_tolerance(fused_ensemble, precision):
+    config = make_config(fused_ensemble, precision)
+    ensemble = trained_ensemble(config)
+    engine = InferenceEngine(config, ensemble)
+
+    with engine.snapshot():
+        pass
+    assert engine.precision == precision
+
+    states, actions, _, _, _ = ensemble.replay_memory.sample(256)
+    with ensemble.snapshot() as source:
+        assert engine.prediction_error(source, states, actions) <= config.inference_tolerance
+
+def test_refresh_records_precision_and_error():
+    config = make_config(True, "bf16")
+    ensemble = trained_ensemble(config)
+    engine = InferenceEngine(config, ensemble)
+
+    with engine.snapshot():
+        pass
+    assert engine.metrics.record["inference_precision"] == engine.precision
+    assert engine.metrics.record["inference_error"] == engine.error
+    assert engine.error is not None
@@ -0,0 +1,53 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from neat_dynamics.dynamics.prioritized_replay import PrioritizedReplayMemory, SumTree
+
+OB_DIM = 3
+CAPACITY = 64
+
+Args = namedtuple("GenericDict", ["memory_capacity", "per_alpha", "per_beta", "per_eps"])
+
+def full_memory(per_eps=0.001):
+    memory = PrioritizedReplayMemory(Args(CAPACITY, 0.6, 0.4, per_eps), OB_DIM)
+    rng = np.random.default_rng(0)
+    memory.add_transitions(
+        rng.standard_normal((CAPACITY, OB_DIM)).astype(np.float32),
+        rng.integers(2, size=CAPACITY),
+        rng.standard_normal(CAPACITY).astype(np.float32),
+        rng.standard_normal((CAPACITY, OB_DIM)).astype(np.float32),
+        np.zeros(CAPACITY, dtype=bool))
+    return memory
+
+def test_sum_tree_ignores_empty_updates():
+    tree = SumTree(8)
+    tree.update(np.array([], dtype=np.int64), np.array([]))
+    tree.update(np.array([1, 3]), np.array([2.0, 1.0]))
+    assert tree.total() == 3.0
+    assert tree.find([0.5, 2.5]).tolist() == [1, 3]
+    assert len(tree.find([])) == 0
+
+@pytest.mark.parametrize("per_eps", [0.001, 0.0])
+def test_zero_priority_weights_are_finite(per_eps):
+    memory = full_memory(per_eps)
+    memory._tree.update(np.arange(CAPACITY // 2), np.zeros(CAPACITY // 2))
+    # Land every draw on a zero-priority leaf, as the clamp to the last stored index can
+    memory._tree.find = lambda values: np.zeros(len(values), dtype=np.int64)
+
+    _, idxs, weights = memory.sample_prioritized(16)
+    assert (idxs == 0).all()
+    assert torch.isfinite(weights).all()
+    assert (weights > 0).all() and (weights <= 1).all()
+
+def test_weights_favour_rare_transitions():
+    memory = full_memory()
+    memory._tree.update(np.arange(CAPACITY), np.linspace(0.1, 1.0, CAPACITY))
+    _, idxs, weights = memory.sample_prioritized(32)
+    priorities = memory._tree.get(idxs)
+    # Lower priority, more often skipped, so a larger weight
+    order = np.argsort(priorities)
+    assert (np.diff(weights.numpy()[order]) <= 1e-6).all()